@@ -2,11 +2,14 @@
 Code from https://github.com/hassony2/torch_videovision
 """
 
+import math
 import numbers
 
 import random
 import numpy as np
 import PIL
+import torch
+import torch.nn.functional as F
 
 from skimage.transform import resize, rotate
 import torchvision
@@ -342,3 +345,178 @@ class AllAugmentationTransform:
         for t in self.transforms:
             clip = t(clip)
         return clip
+
+
+def rgb_to_grayscale(img):
+    r, g, b = img.unbind(dim=-3)
+    return (0.299 * r + 0.587 * g + 0.114 * b).unsqueeze(-3)
+
+
+def rgb_to_hue(img, maxc, minc):
+    """
+    Hue in [0, 1) of rgb images, maxc and minc are their per pixel channel maximum and minimum.
+    """
+    r, g, b = img.unbind(dim=-3)
+    maxc, minc = maxc.squeeze(-3), minc.squeeze(-3)
+    chroma = maxc - minc
+    h = torch.where(maxc == r, g - b, torch.where(maxc == g, 2.0 * chroma + b - r, 4.0 * chroma + r - g))
+    h = h / torch.where(chroma > 0, chroma, torch.ones_like(chroma))
+    return torch.remainder(h / 6.0, 1.0).unsqueeze(-3)
+
+
+def uniform(low, high, size, device):
+    return low + (high - low) * torch.rand(size, device=device)
+
+
+class TensorAugmentationTransform:
+    """
+    AllAugmentationTransform on batches of clips, B x T x C x H x W float tensors in [0, 1], on any device.
+    Every clip draws its own parameters from the same distributions as AllAugmentationTransform, the
+    rotation, resize and crop are a single affine resampling with grid_sample. Areas outside the
+    rotated frame are black, like skimage's rotate, crops larger than the resized frame repeat its border.
+    Called on a T x H x W x C array it augments that single clip, as AllAugmentationTransform, uint8 clips
+    are scaled to [0, 1].
+    """
+
+    def __init__(self, resize_param=None, rotation_param=None, flip_param=None, crop_param=None, jitter_param=None):
+        self.flip = RandomFlip(**flip_param) if flip_param is not None else None
+        self.degrees = RandomRotation(**rotation_param).degrees if rotation_param is not None else None
+        self.ratio = RandomResize(**resize_param).ratio if resize_param is not None else None
+        self.crop_size = RandomCrop(**crop_param).size if crop_param is not None else None
+        self.jitter = ColorJitter(**jitter_param) if jitter_param is not None else None
+
+    def __call__(self, clip):
+        clip = np.asarray(clip)
+        if clip.dtype == np.uint8:
+            clips = torch.from_numpy(np.ascontiguousarray(clip)).float().div_(255)
+        else:
+            clips = torch.from_numpy(np.ascontiguousarray(clip, dtype='float32'))
+        clips = clips.permute(0, 3, 1, 2).unsqueeze(0)
+        return self.augment(clips)[0].permute(0, 2, 3, 1).numpy()
+
+    def augment_pairs(self, source, driving):
+        """
+        Augment B x C x H x W source and driving frames as clips of two frames.
+        """
+        clips = self.augment(torch.stack([source, driving], dim=1))
+        return clips[:, 0], clips[:, 1]
+
+    def augment(self, clips):
+        if self.flip is not None:
+            clips = self.random_flip(clips)
+        if self.degrees is not None or self.ratio is not None or self.crop_size is not None:
+            clips = self.random_affine(clips)
+        if self.jitter is not None:
+            clips = self.color_jitter(clips)
+        return clips
+
+    def random_flip(self, clips):
+        bs = clips.shape[0]
+        time_flip = torch.rand(bs, device=clips.device) < (0.5 if self.flip.time_flip else 0)
+        # as RandomFlip, a time flipped clip is not flipped horizontally
+        horizontal_flip = (torch.rand(bs, device=clips.device) < (0.5 if self.flip.horizontal_flip else 0))
+        horizontal_flip = horizontal_flip & ~time_flip
+        if time_flip.any():
+            clips = torch.where(time_flip.view(-1, 1, 1, 1, 1), clips.flip(1), clips)
+        if horizontal_flip.any():
+            clips = torch.where(horizontal_flip.view(-1, 1, 1, 1, 1), clips.flip(4), clips)
+        return clips
+
+    def random_affine(self, clips):
+        bs, num_frames, c, h, w = clips.shape
+        device = clips.device
+
+        angle = torch.zeros(bs, device=device)
+        if self.degrees is not None:
+            angle = uniform(self.degrees[0], self.degrees[1], bs, device) * math.pi / 180
+        scale = torch.ones(bs, device=device)
+        if self.ratio is not None:
+            scale = uniform(self.ratio[0], self.ratio[1], bs, device)
+        resized_h, resized_w = (h * scale).floor(), (w * scale).floor()
+
+        if self.crop_size is not None:
+            out_h, out_w = self.crop_size
+        elif self.ratio is not None:
+            if bs > 1:
+                raise ValueError("Random resizing gives clips of different sizes, a crop_param is needed for batches")
+            out_h, out_w = int(resized_h[0]), int(resized_w[0])
+        else:
+            out_h, out_w = h, w
+        # random crop offsets, centered padding when the resized frame is smaller than the crop
+        y1 = torch.where(resized_h > out_h, (torch.rand(bs, device=device) * (resized_h - out_h + 1)).floor(),
+                         -((out_h - resized_h) // 2))
+        x1 = torch.where(resized_w > out_w, (torch.rand(bs, device=device) * (resized_w - out_w + 1)).floor(),
+                         -((out_w - resized_w) // 2))
+
+        # output normalized coordinates -> output pixels -> resized pixels -> rotated frame pixels relative
+        # to the frame center (a, b) = (ax * u + bx, ay * v + by) -> rotated back -> input normalized coordinates
+        sx, sy = resized_w / w, resized_h / h
+        ax, bx = out_w / (2 * sx), (out_w / 2 + x1) / sx - w / 2
+        ay, by = out_h / (2 * sy), (out_h / 2 + y1) / sy - h / 2
+        cos, sin = torch.cos(angle), torch.sin(angle)
+        theta = torch.stack([torch.stack([2 * cos * ax / w, -2 * sin * ay / w, 2 * (cos * bx - sin * by) / w], dim=1),
+                             torch.stack([2 * sin * ax / h, 2 * cos * ay / h, 2 * (sin * bx + cos * by) / h], dim=1)],
+                            dim=1)
+
+        grid = F.affine_grid(theta, (bs, c, out_h, out_w), align_corners=False)
+        grid = grid.repeat_interleave(num_frames, dim=0)
+        frames = F.grid_sample(clips.reshape(bs * num_frames, c, h, w), grid, align_corners=False,
+                               padding_mode='zeros' if self.degrees is not None else 'border')
+        return frames.view(bs, num_frames, c, out_h, out_w)
+
+    def color_jitter(self, clips):
+        bs = clips.shape[0]
+        device = clips.device
+        ops = []
+        if self.jitter.brightness > 0:
+            ops.append((self.adjust_brightness,
+                        uniform(max(0, 1 - self.jitter.brightness), 1 + self.jitter.brightness, bs, device)))
+        if self.jitter.saturation > 0:
+            ops.append((self.adjust_saturation,
+                        uniform(max(0, 1 - self.jitter.saturation), 1 + self.jitter.saturation, bs, device)))
+        if self.jitter.hue > 0:
+            ops.append((self.adjust_hue, uniform(-self.jitter.hue, self.jitter.hue, bs, device)))
+        if self.jitter.contrast > 0:
+            ops.append((self.adjust_contrast,
+                        uniform(max(0, 1 - self.jitter.contrast), 1 + self.jitter.contrast, bs, device)))
+        if not ops:
+            return clips
+
+        # every clip applies the adjustments in its own random order, step by step on the clips that
+        # have a given adjustment at that step
+        order = torch.argsort(torch.rand(bs, len(ops)), dim=1).to(device)
+        clips = clips.clone()
+        for step in range(len(ops)):
+            for op_idx, (op, factor) in enumerate(ops):
+                idx = (order[:, step] == op_idx).nonzero(as_tuple=True)[0]
+                if len(idx) == bs:
+                    clips = op(clips, factor.view(-1, 1, 1, 1, 1))
+                elif len(idx):
+                    clips[idx] = op(clips[idx], factor[idx].view(-1, 1, 1, 1, 1))
+        return clips
+
+    @staticmethod
+    def blend(img, other, factor):
+        return (factor * img + (1 - factor) * other).clamp(0, 1)
+
+    @staticmethod
+    def adjust_brightness(clips, factor):
+        return (clips * factor).clamp(0, 1)
+
+    @staticmethod
+    def adjust_saturation(clips, factor):
+        return TensorAugmentationTransform.blend(clips, rgb_to_grayscale(clips), factor)
+
+    @staticmethod
+    def adjust_contrast(clips, factor):
+        mean = rgb_to_grayscale(clips).mean(dim=(-3, -2, -1), keepdim=True)
+        return TensorAugmentationTransform.blend(clips, mean, factor)
+
+    @staticmethod
+    def adjust_hue(clips, factor):
+        # the hsv round trip with a shifted hue in closed form, value and saturation are unchanged
+        maxc = clips.amax(dim=-3, keepdim=True)
+        minc = clips.amin(dim=-3, keepdim=True)
+        hue = rgb_to_hue(clips, maxc, minc) + factor
+        k = torch.remainder(torch.tensor([5.0, 3.0, 1.0], device=clips.device).view(3, 1, 1) + hue * 6, 6)
+        return maxc - (maxc - minc) * torch.minimum(k, 4 - k).clamp(0, 1)
@@ -0,0 +1,599 @@
+import os
+import sys
+import time
+import subprocess
+from argparse import ArgumentParser
+
+import yaml
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from demo import build_networks, load_checkpoints, load_video, make_animation, frames_to_tensor, tensor_to_frames, StreamingAnimator
+from frame_resize import RESIZE_BACKENDS, INTERPOLATE_ANTIALIAS
+from frames_dataset import FramesDataset, BatchPrefetcher, collate_pairs, to_float
+from modules.bg_motion_predictor import BGMotionPredictor
+from modules.model import GeneratorFullModel, ImagePyramide, Vgg19
+from modules.util import set_activation_checkpointing
+
+
+def synthetic_driving(img_shape, num_frames, seed=0):
+    """
+    Random driving frames, stands in for a webcam when only the timing matters.
+    """
+    rng = np.random.RandomState(seed)
+    for _ in range(num_frames):
+        yield rng.randint(0, 256, size=(img_shape[0], img_shape[1], 3), dtype=np.uint8)
+
+
+def benchmark_streaming(opt, device):
+    inpainting, kp_detector, dense_motion_network, avd_network = load_checkpoints(
+        config_path=opt.config, checkpoint_path=opt.checkpoint, device=device)
+    source_image = next(synthetic_driving(opt.img_shape, 1, seed=1))
+
+    animator = StreamingAnimator(source_image, inpainting, kp_detector, dense_motion_network, avd_network,
+                                 device=device, mode=opt.mode_animation, latency_budget=1 / opt.target_fps,
+                                 quality=opt.quality, draft_scale=opt.draft_scale)
+    # the first frames pay for allocator and kernel warm up
+    for _ in animator.stream(synthetic_driving(opt.img_shape, opt.warmup)):
+        pass
+    animator.reset()
+    for _ in animator.stream(synthetic_driving(opt.img_shape, opt.num_frames)):
+        pass
+    return animator.latency_stats()
+
+
+def benchmark_load(opt, device):
+    """
+    Wall time of load_checkpoints, run it once with a .pth.tar checkpoint and once with the
+    directory written by convert_checkpoint.py to compare both formats.
+    """
+    times = []
+    for _ in range(opt.runs):
+        start = time.perf_counter()
+        load_checkpoints(config_path=opt.config, checkpoint_path=opt.checkpoint, device=device)
+        times.append(time.perf_counter() - start)
+    times = np.array(times) * 1000
+    return {'runs': len(times), 'p50_ms': float(np.percentile(times, 50)), 'min_ms': float(times.min())}
+
+
+def import_costs(importtime_log):
+    """
+    Cumulative import time in ms of the packages imported directly by the entry point,
+    parsed from a python -X importtime log.
+    """
+    costs = {}
+    for line in importtime_log.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # nested imports are indented by two spaces per level below their parent
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            costs[name.strip()] = int(cumulative) / 1000
+    return costs
+
+
+def benchmark_startup(opt):
+    """
+    Cost of importing each entry point in a fresh interpreter, with its most expensive packages.
+    """
+    stats = {}
+    root_dir = os.path.dirname(os.path.abspath(__file__))
+    for entry_point in ['demo', 'run', 'predict']:
+        times = []
+        for _ in range(opt.runs):
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + entry_point],
+                                    cwd=root_dir, capture_output=True, text=True)
+            times.append(time.perf_counter() - start)
+            if result.returncode != 0:
+                break
+        if result.returncode != 0:
+            errors = [line for line in result.stderr.splitlines() if not line.startswith('import time:')]
+            stats[entry_point] = 'failed, ' + (errors[-1] if errors else 'exit code %s' % result.returncode)
+            continue
+        costs = import_costs(result.stderr)
+        heaviest = sorted(costs.items(), key=lambda item: -item[1])[:opt.top_imports]
+        stats[entry_point + '_p50_ms'] = float(np.percentile(np.array(times) * 1000, 50))
+        stats[entry_point + '_heaviest'] = ', '.join('%s %.0fms' % item for item in heaviest)
+    return stats
+
+
+def benchmark_resize(opt):
+    """
+    Decode + resize throughput of load_video for every resize backend, with the largest
+    pixel difference to the skimage reference, overall and on the outermost rows and columns.
+    """
+    stats = {}
+    reference = None
+    backends = [backend for backend in RESIZE_BACKENDS if backend != 'torch' or INTERPOLATE_ANTIALIAS]
+    for backend in ['skimage'] + [backend for backend in backends if backend != 'skimage']:
+        times = []
+        for _ in range(opt.runs):
+            start = time.perf_counter()
+            video, _ = load_video(opt.driving_video, opt.img_shape, resize_backend=backend)
+            times.append(time.perf_counter() - start)
+        if reference is None:
+            reference = video
+        stats[backend + '_fps'] = float(len(video) / np.median(times))
+        diff = np.abs(video.astype(np.int16) - reference)
+        stats[backend + '_max_diff'] = int(diff.max())
+        stats[backend + '_border_max_diff'] = int(max(diff[:, [0, -1]].max(), diff[:, :, [0, -1]].max()))
+    return stats
+
+
+def psnr(predictions, reference):
+    """
+    PSNR in dB of uint8 frames against reference frames, over the whole sequence.
+    """
+    mse = np.mean((np.asarray(predictions, dtype=np.float64) - np.asarray(reference, dtype=np.float64)) ** 2)
+    return float('inf') if mse == 0 else float(10 * np.log10(255 ** 2 / mse))
+
+
+def benchmark_reuse(opt, device):
+    """
+    Fraction of frames skipped by --reuse_threshold on the first num_frames of driving_video,
+    with the speedup and the PSNR against rendering every frame.
+    """
+    networks = load_checkpoints(config_path=opt.config, checkpoint_path=opt.checkpoint, device=device)
+    driving_video, _ = load_video(opt.driving_video, opt.img_shape)
+    driving_video = driving_video[:opt.num_frames]
+    source_image = driving_video[0]
+
+    def run(reuse_threshold):
+        animator = StreamingAnimator(source_image, *networks, device=device, mode=opt.mode_animation,
+                                     reuse_threshold=reuse_threshold)
+        start = time.perf_counter()
+        predictions = [animator(frame) for frame in driving_video]
+        return predictions, time.perf_counter() - start, animator.num_reused
+
+    reference, full_seconds, _ = run(None)
+    predictions, reuse_seconds, num_reused = run(opt.reuse_threshold)
+    return {
+        'frames': len(driving_video),
+        'skipped_fraction': num_reused / len(driving_video),
+        'speedup': full_seconds / reuse_seconds,
+        'psnr_db': psnr(predictions, reference),
+    }
+
+
+def benchmark_keyframes(opt, device):
+    """
+    Throughput and PSNR against full rendering of make_animation with every keyframe interval in
+    opt.intervals, on the first num_frames of driving_video.
+    """
+    networks = load_checkpoints(config_path=opt.config, checkpoint_path=opt.checkpoint, device=device)
+    driving_video, _ = load_video(opt.driving_video, opt.img_shape)
+    driving_video = driving_video[:opt.num_frames]
+    source_image = driving_video[0]
+
+    stats = {}
+    reference = None
+    for interval in [1] + [interval for interval in opt.intervals if interval != 1]:
+        start = time.perf_counter()
+        predictions = make_animation(source_image, driving_video, *networks, device=device, mode=opt.mode_animation,
+                                     batch_size=opt.batch_size, keyframe_interval=interval)
+        seconds = time.perf_counter() - start
+        if reference is None:
+            reference, full_seconds = predictions, seconds
+        stats['N=%d_fps' % interval] = len(driving_video) / seconds
+        stats['N=%d_speedup' % interval] = full_seconds / seconds
+        stats['N=%d_psnr_db' % interval] = psnr(predictions, reference)
+    return stats
+
+
+def benchmark_tps(opt, device):
+    """
+    Dense motion time per frame for every TPS grid stride in opt.strides, with the largest deformation error in
+    pixels of the dense motion resolution and the PSNR of the predictions against exact TPS evaluation.
+    """
+    networks = load_checkpoints(config_path=opt.config, checkpoint_path=opt.checkpoint, device=device)
+    dense_motion_network = networks[2]
+    driving_video, _ = load_video(opt.driving_video, opt.img_shape)
+    driving_video = driving_video[:opt.num_frames]
+    animator = StreamingAnimator(driving_video[0], *networks, device=device, mode=opt.mode_animation)
+    animator.set_initial_frame(driving_video[0])
+    with torch.no_grad():
+        kp_norm = [animator.normalize_kp(animator.kp_detector(frames_to_tensor(driving_video[i:(i + opt.batch_size)],
+                                                                              device)))
+                   for i in range(0, len(driving_video), opt.batch_size)]
+
+    stats = {}
+    reference = None
+    for stride in [1] + [stride for stride in opt.strides if stride != 1]:
+        dense_motion_network.tps_stride = stride
+        seconds, deformations, predictions = 0, [], []
+        with torch.no_grad():
+            for kp in kp_norm:
+                start = time.perf_counter()
+                motion = animator.motion(kp)
+                deformations.append(motion['deformation'].cpu())
+                seconds += time.perf_counter() - start
+                predictions.append(tensor_to_frames(animator.decode(motion)))
+        deformations, predictions = torch.cat(deformations), np.concatenate(predictions)
+        if reference is None:
+            reference = deformations, predictions
+        # grid coordinates span [-1, 1] over w - 1 pixels
+        error = (deformations - reference[0]).abs().max().item() * (deformations.shape[2] - 1) / 2
+        stats['stride=%d_motion_ms' % stride] = seconds * 1000 / len(driving_video)
+        stats['stride=%d_max_error_px' % stride] = error
+        stats['stride=%d_psnr_db' % stride] = psnr(predictions, reference[1])
+    return stats
+
+
+def benchmark_prune(opt, device):
+    """
+    Fraction of TPS transformations skipped, speedup and PSNR against full rendering for every threshold in
+    opt.prune_thresholds, on the first num_frames of driving_video.
+    """
+    networks = load_checkpoints(config_path=opt.config, checkpoint_path=opt.checkpoint, device=device)
+    driving_video, _ = load_video(opt.driving_video, opt.img_shape)
+    driving_video = driving_video[:opt.num_frames]
+    source_image = driving_video[0]
+
+    stats = {'num_tps': networks[2].num_tps}
+    reference = None
+    for threshold in [None] + opt.prune_thresholds:
+        animator = StreamingAnimator(source_image, *networks, device=device, mode=opt.mode_animation,
+                                     prune_threshold=threshold)
+        start = time.perf_counter()
+        predictions = [animator(frame) for frame in driving_video]
+        seconds = time.perf_counter() - start
+        if reference is None:
+            reference, full_seconds = predictions, seconds
+            continue
+        stats['%g_pruned_fraction' % threshold] = animator.pruned_fraction()
+        stats['%g_speedup' % threshold] = full_seconds / seconds
+        stats['%g_psnr_db' % threshold] = psnr(predictions, reference)
+    return stats
+
+
+def benchmark_tiled(opt, device):
+    """
+    Time per frame and peak device memory (cuda only) of rendering a synthetic source of opt.source_shape
+    directly and in opt.tile_size tiles, and the uint8 differences of the tiled outputs: a single tile
+    at the model resolution against decode, opt.tile_size tiles against a single tile at opt.source_shape.
+    """
+    networks = load_checkpoints(config_path=opt.config, checkpoint_path=opt.checkpoint, device=device)
+    source_image = next(synthetic_driving(opt.source_shape, 1, seed=1))
+    driving_video = list(synthetic_driving(opt.img_shape, opt.num_frames))
+
+    stats = {}
+    for tile_size in [None, opt.tile_size]:
+        name = 'tiled' if tile_size else 'direct'
+        if device.type == 'cuda':
+            torch.cuda.empty_cache()
+            torch.cuda.reset_peak_memory_stats(device)
+        try:
+            animator = StreamingAnimator(source_image, *networks, device=device, mode=opt.mode_animation,
+                                         tile_size=tile_size, motion_shape=opt.img_shape)
+            if tile_size is None:
+                # the direct path feeds the full resolution source to every network
+                driving = [np.asarray(frame).repeat(opt.source_shape[0] // opt.img_shape[0], 0)
+                           .repeat(opt.source_shape[1] // opt.img_shape[1], 1) for frame in driving_video]
+            else:
+                driving = driving_video
+            start = time.perf_counter()
+            for frame in driving:
+                animator(frame)
+            stats[name + '_ms'] = (time.perf_counter() - start) * 1000 / len(driving)
+        except RuntimeError as e:
+            stats[name + '_ms'] = 'failed, %s' % str(e).splitlines()[0]
+        if device.type == 'cuda':
+            stats[name + '_peak_MB'] = torch.cuda.max_memory_allocated(device) / 2 ** 20
+
+    def render(source, tile_size):
+        animator = StreamingAnimator(source, *networks, device=device, mode=opt.mode_animation,
+                                     tile_size=tile_size, motion_shape=opt.img_shape)
+        return np.stack([animator(frame) for frame in driving_video[:2]]).astype(np.float64)
+
+    # a tile covering the source renders exactly like decode, smaller tiles differ by the instance norms
+    # of the decoder, which see one tile at a time, most visibly at the tile seams
+    model_source = next(synthetic_driving(opt.img_shape, 1, seed=1))
+    stats['single_tile_max_diff'] = float(np.abs(render(model_source, None)
+                                                 - render(model_source, max(opt.img_shape))).max())
+    diff = np.abs(render(source_image, opt.tile_size) - render(source_image, max(opt.source_shape)))
+    stats['tiled_mean_diff'] = float(diff.mean())
+    stats['tiled_max_diff'] = float(diff.max())
+    return stats
+
+
+def dataloader_throughput(opt, **dataset_kwargs):
+    """
+    Training samples per second of a DataLoader over the config's dataset, dataset_kwargs override
+    the config's dataset_params.
+    """
+    with open(opt.config) as f:
+        dataset_params = dict(yaml.full_load(f)['dataset_params'], **dataset_kwargs)
+    if opt.dataset_root is not None and 'root_dir' not in dataset_kwargs:
+        dataset_params['root_dir'] = opt.dataset_root
+    dataset = FramesDataset(is_train=True, **dataset_params)
+    # with pairs_per_video > 1 a batch holds opt.batch_size pairs and num_samples counts pairs
+    loader = DataLoader(dataset, batch_size=max(1, opt.batch_size // dataset.pairs_per_video), shuffle=True,
+                        num_workers=opt.num_workers, drop_last=False, persistent_workers=opt.num_workers > 0,
+                        collate_fn=collate_pairs if dataset.pairs_per_video > 1 else None)
+    num_samples, start = 0, None
+    while num_samples < opt.num_items:
+        for batch in loader:
+            # the first batch pays for the worker start up
+            if start is None:
+                start = time.perf_counter()
+                continue
+            num_samples += len(batch['name'])
+            if num_samples >= opt.num_items:
+                break
+    return num_samples / (time.perf_counter() - start)
+
+
+def benchmark_dataset(opt):
+    """
+    Dataloader throughput reading whole videos, decoding only the sampled frames, augmenting them with
+    torch tensors, returning uint8 samples, with opt.shard_root reading the shards written by
+    convert_dataset.py and, with opt.pairs_per_video > 1, sampling several pairs per decoded video.
+    """
+    stats = {
+        'whole_video_samples_per_s': dataloader_throughput(opt, random_access=False),
+        'random_access_samples_per_s': dataloader_throughput(opt, random_access=True),
+        'tensor_augmentation_samples_per_s': dataloader_throughput(opt, random_access=True,
+                                                                   augmentation_backend='tensor'),
+        'uint8_samples_per_s': dataloader_throughput(opt, random_access=True, uint8_samples=True),
+    }
+    if opt.shard_root is not None:
+        stats['shards_samples_per_s'] = dataloader_throughput(opt, root_dir=opt.shard_root)
+    if opt.pairs_per_video > 1:
+        stats['multi_pair_samples_per_s'] = dataloader_throughput(opt, random_access=True,
+                                                                  pairs_per_video=opt.pairs_per_video,
+                                                                  clip_cache_size=opt.clip_cache_size)
+    return stats
+
+
+class SyntheticPairs(torch.utils.data.Dataset):
+    """
+    Random uint8 source and driving frames, the same for an index on every pass.
+    """
+
+    def __init__(self, img_shape, num_items):
+        self.img_shape = img_shape
+        self.num_items = num_items
+
+    def __len__(self):
+        return self.num_items
+
+    def __getitem__(self, idx):
+        generator = torch.Generator().manual_seed(idx)
+        frames = torch.randint(0, 256, (2, 3) + tuple(self.img_shape), dtype=torch.uint8, generator=generator)
+        return {'source': frames[0], 'driving': frames[1]}
+
+
+def benchmark_prefetch(opt, device):
+    """
+    Steps per second of a stand-in training step fed with batches copied synchronously and through
+    BatchPrefetcher, which on a gpu copies the batches pinned by the DataLoader on a side stream, and
+    whether both give the same batches.
+    """
+    loader = DataLoader(SyntheticPairs(opt.img_shape, opt.num_items), batch_size=opt.batch_size,
+                        num_workers=opt.num_workers, pin_memory=device.type == 'cuda')
+    network = torch.nn.Sequential(*[torch.nn.Conv2d(3 if i == 0 else 64, 64, 3, padding=1)
+                                    for i in range(4)]).to(device)
+
+    def run(batches):
+        sums = []
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for batch in batches():
+            network(torch.cat([batch['source'], batch['driving']])).mean().backward()
+            sums.append(torch.stack([batch['source'].double().sum(), batch['driving'].double().sum()]))
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        return len(sums) / (time.perf_counter() - start), torch.stack(sums).cpu()
+
+    def synchronous():
+        for batch in loader:
+            yield {key: to_float(batch[key].to(device)) for key in ['source', 'driving']}
+
+    prefetcher = BatchPrefetcher(loader, device=device)
+    data_wait = []
+
+    def prefetched():
+        for batch in prefetcher:
+            data_wait.append(prefetcher.data_wait)
+            yield batch
+
+    run(synchronous)
+    sync_steps, sync_sums = run(synchronous)
+    prefetch_steps, prefetch_sums = run(prefetched)
+    return {'side_stream': prefetcher.stream is not None, 'sync_steps_per_s': sync_steps,
+            'prefetch_steps_per_s': prefetch_steps, 'mean_data_wait_ms': float(np.mean(data_wait)) * 1000,
+            'batches_match': bool(torch.equal(sync_sums, prefetch_sums))}
+
+
+def training_step(module, compute_loss, device):
+    """
+    Seconds of one forward and backward pass of compute_loss(), the loss of module, and MB of the tensors
+    it saved for the backward pass, each storage counted once.
+    """
+    storages = {}
+
+    def pack(tensor):
+        storages[tensor.data_ptr()] = tensor.numel() * tensor.element_size()
+        # a saved output that keeps its grad_fn would never be freed
+        return tensor.detach()
+
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        loss = compute_loss()
+    loss.backward()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    module.zero_grad()
+    return time.perf_counter() - start, sum(storages.values()) / 2 ** 20
+
+
+def benchmark_checkpointing(opt, device):
+    """
+    Training step time and memory without activation checkpointing, with it in the dense motion hourglass,
+    in the inpainting network and everywhere, vgg included.
+    """
+    with open(opt.config) as f:
+        config = yaml.full_load(f)
+    train_params = dict(config['train_params'])
+    if opt.skip_perceptual:
+        train_params['loss_weights'] = dict(train_params['loss_weights'], perceptual=[0] * 5)
+    settings = {
+        'none': {},
+        'hourglass': {'dense_motion_network': ['DownBlock2d', 'UpBlock2d']},
+        'inpainting': {'inpainting_network': ['SameBlock2d', 'DownBlock2d', 'UpBlock2d', 'ResBlock2d']},
+    }
+    settings['all'] = dict(settings['hourglass'], **settings['inpainting'])
+    if not opt.skip_perceptual:
+        settings['all']['vgg'] = ['Vgg19']
+
+    torch.manual_seed(0)
+    shape = (opt.batch_size, 3) + tuple(opt.img_shape)
+    x = {'source': torch.rand(shape, device=device), 'driving': torch.rand(shape, device=device)}
+    stats = {}
+    for setting, blocks in settings.items():
+        # the same random weights for every setting
+        torch.manual_seed(0)
+        networks = build_networks(config, ['inpainting_network', 'kp_detector', 'dense_motion_network'])
+        bg_predictor = BGMotionPredictor() if config['model_params']['common_params']['bg'] else None
+        generator_full = GeneratorFullModel(networks['kp_detector'], bg_predictor, networks['dense_motion_network'],
+                                            networks['inpainting_network'], train_params).to(device)
+        generator_full.train()
+        for name, block_names in blocks.items():
+            set_activation_checkpointing(getattr(generator_full, name), block_names)
+        if device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats()
+        def compute_loss():
+            return sum(value.mean() for value in generator_full(x, 0)[0].values())
+        training_step(generator_full, compute_loss, device)
+        times, saved = zip(*[training_step(generator_full, compute_loss, device) for _ in range(opt.runs)])
+        stats[setting + '_step_s'] = np.median(times)
+        stats[setting + '_saved_MB'] = saved[0]
+        if device.type == 'cuda':
+            stats[setting + '_peak_MB'] = torch.cuda.max_memory_allocated() / 2 ** 20
+        del generator_full, networks
+    return stats
+
+
+def benchmark_perceptual(opt, device):
+    """
+    Time and saved MB of the pyramide perceptual loss with its backward pass and time of the image pyramide
+    alone, downsampled from full resolution at every scale and as a cascade. Real and generated are
+    consecutive frames of driving_video, vgg has random weights, the timing does not depend on them.
+    """
+    with open(opt.config) as f:
+        config = yaml.full_load(f)
+    train_params = dict(config['train_params'])
+    train_params['loss_weights'] = dict(train_params['loss_weights'], perceptual=[0] * 5)
+    torch.manual_seed(0)
+    networks = build_networks(config, ['inpainting_network', 'kp_detector', 'dense_motion_network'])
+    generator_full = GeneratorFullModel(networks['kp_detector'], None, networks['dense_motion_network'],
+                                        networks['inpainting_network'], train_params).to(device)
+    generator_full.vgg = Vgg19(pretrained=False).to(device)
+    generator_full.loss_weights = config['train_params']['loss_weights']
+
+    driving_video, _ = load_video(opt.driving_video, opt.img_shape)
+    real = frames_to_tensor(driving_video[:opt.batch_size], device)
+    generated = frames_to_tensor(driving_video[1:(opt.batch_size + 1)], device).requires_grad_()
+
+    stats = {}
+    for cascade in [False, True]:
+        name = 'cascade' if cascade else 'direct'
+        generator_full.pyramid = ImagePyramide(train_params['scales'], real.shape[1], cascade).to(device)
+
+        def compute_loss():
+            return generator_full.perceptual_loss(real, generated)
+        training_step(generator_full, compute_loss, device)
+        times, saved = zip(*[training_step(generator_full, compute_loss, device) for _ in range(opt.runs)])
+        with torch.no_grad():
+            start = time.perf_counter()
+            for _ in range(opt.runs):
+                generator_full.pyramid(real)
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+        stats[name + '_pyramide_ms'] = (time.perf_counter() - start) * 1000 / opt.runs
+        stats[name + '_perceptual_ms'] = np.median(times) * 1000
+        stats[name + '_saved_MB'] = saved[0]
+        with torch.no_grad():
+            stats[name + '_loss'] = compute_loss().item()
+    return stats
+
+
+if __name__ == "__main__":
+    if sys.version_info[0] < 3:
+        raise Exception("You must use Python 3 or higher. Recommended version is Python 3.9")
+
+    parser = ArgumentParser()
+    parser.add_argument("--mode", default="streaming", choices=["streaming", "load", "startup", "resize", "reuse", "keyframes", "tps", "prune", "tiled", "dataset", "checkpointing", "perceptual", "prefetch"])
+    parser.add_argument("--config", default='config/vox-256.yaml', help="path to config")
+    parser.add_argument("--checkpoint", default=None,
+                        help="path to checkpoint, random weights are used if not given")
+    parser.add_argument("--driving_video", default='./assets/driving.mp4', help="video decoded by the resize, reuse, keyframes, tps, prune and perceptual modes")
+    parser.add_argument("--img_shape", default="256,256", type=lambda x: list(map(int, x.split(','))),
+                        help='Shape of image, that the model was trained on.')
+    parser.add_argument("--mode_animation", default='relative', choices=['standard', 'relative', 'avd'])
+    parser.add_argument("--num_frames", default=100, type=int, help="number of timed frames")
+    parser.add_argument("--runs", default=5, type=int, help="number of timed runs for whole-process measurements")
+    parser.add_argument("--top_imports", default=5, type=int, help="number of heaviest imports to list")
+    parser.add_argument("--warmup", default=5, type=int, help="number of untimed frames")
+    parser.add_argument("--target_fps", default=25, type=float, help="per-frame latency budget is 1 / target_fps")
+    parser.add_argument("--reuse_threshold", default=0.005, type=float, help="keypoint threshold of the reuse mode")
+    parser.add_argument("--intervals", default="2,4,8", type=lambda x: list(map(int, x.split(','))),
+                        help="keyframe intervals compared by the keyframes mode")
+    parser.add_argument("--strides", default="2,4", type=lambda x: list(map(int, x.split(','))),
+                        help="TPS grid strides compared by the tps mode")
+    parser.add_argument("--prune_thresholds", default="0.001,0.01", type=lambda x: list(map(float, x.split(','))),
+                        help="contribution thresholds compared by the prune mode")
+    parser.add_argument("--source_shape", default="1024,1024", type=lambda x: list(map(int, x.split(','))),
+                        help="source resolution of the tiled mode, a multiple of img_shape")
+    parser.add_argument("--tile_size", default=256, type=int, help="tile size of the tiled mode")
+    parser.add_argument("--dataset_root", default=None, help="dataset root of the dataset mode, the config's by default")
+    parser.add_argument("--shard_root", default=None, help="output of convert_dataset.py to compare in the dataset mode")
+    parser.add_argument("--pairs_per_video", default=1, type=int, help="pairs sampled per decoded video in the dataset mode")
+    parser.add_argument("--clip_cache_size", default=0, type=int, help="decoded videos cached per worker with --pairs_per_video")
+    parser.add_argument("--num_items", default=200, type=int, help="number of training samples timed by the dataset and prefetch modes")
+    parser.add_argument("--num_workers", default=4, type=int, help="dataloader workers of the dataset and prefetch modes")
+    parser.add_argument("--batch_size", default=1, type=int, help="batch size of the keyframes, tps, dataset, checkpointing, perceptual and prefetch modes")
+    parser.add_argument("--quality", default='full', choices=['full', 'draft'], help="quality of the streaming mode")
+    parser.add_argument("--draft_scale", default=1.0, type=float, help="output scale of the draft quality")
+    parser.add_argument("--skip_perceptual", action="store_true",
+                        help="leave out the vgg perceptual loss in the checkpointing mode, it needs pretrained weights")
+    parser.add_argument("--cpu", dest="cpu", action="store_true", help="cpu mode.")
+
+    opt = parser.parse_args()
+    device = torch.device('cpu') if opt.cpu or not torch.cuda.is_available() else torch.device('cuda')
+
+    if opt.mode == 'streaming':
+        stats = benchmark_streaming(opt, device)
+    elif opt.mode == 'load':
+        stats = benchmark_load(opt, device)
+    elif opt.mode == 'startup':
+        stats = benchmark_startup(opt)
+    elif opt.mode == 'resize':
+        stats = benchmark_resize(opt)
+    elif opt.mode == 'reuse':
+        stats = benchmark_reuse(opt, device)
+    elif opt.mode == 'keyframes':
+        stats = benchmark_keyframes(opt, device)
+    elif opt.mode == 'tps':
+        stats = benchmark_tps(opt, device)
+    elif opt.mode == 'prune':
+        stats = benchmark_prune(opt, device)
+    elif opt.mode == 'tiled':
+        stats = benchmark_tiled(opt, device)
+    elif opt.mode == 'dataset':
+        stats = benchmark_dataset(opt)
+    elif opt.mode == 'checkpointing':
+        stats = benchmark_checkpointing(opt, device)
+    elif opt.mode == 'perceptual':
+        stats = benchmark_perceptual(opt, device)
+    elif opt.mode == 'prefetch':
+        stats = benchmark_prefetch(opt, device)
+
+    for key, value in stats.items():
+        print("%s: %s" % (key, value))
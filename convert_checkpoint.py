@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+
+from demo import INFERENCE_NETWORKS
+
+
+# tensor offsets in the weight files are aligned to this many bytes
+ALIGNMENT = 64
+
+
+def convert_checkpoint(checkpoint_path, out_dir):
+    """
+    Split a training checkpoint into inference-only weight files, per network the raw tensor data in
+    <name>.bin and the dtype, shape and byte offset of every tensor in <name>.json. Optimizer states and
+    the epoch counter are dropped. The .bin files are memory mapped by numpy, which works with any torch version.
+    """
+    checkpoint = torch.load(checkpoint_path, map_location='cpu')
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for name in INFERENCE_NETWORKS:
+        if name not in checkpoint:
+            continue
+        layout = {}
+        with open(os.path.join(out_dir, name + '.bin'), 'wb') as f:
+            for key, value in checkpoint[name].items():
+                array = np.ascontiguousarray(value.detach().numpy())
+                f.write(b'\0' * (-f.tell() % ALIGNMENT))
+                layout[key] = [array.dtype.str, list(array.shape), f.tell()]
+                f.write(array.tobytes())
+        with open(os.path.join(out_dir, name + '.json'), 'w') as f:
+            json.dump(layout, f)
+        written.append(name)
+    return written
+
+
+if __name__ == "__main__":
+    if sys.version_info[0] < 3:
+        raise Exception("You must use Python 3 or higher. Recommended version is Python 3.9")
+
+    parser = ArgumentParser()
+    parser.add_argument("--checkpoint", required=True, help="path to training checkpoint, e.g. checkpoints/vox.pth.tar")
+    parser.add_argument("--out_dir", default=None,
+                        help="output directory, defaults to the checkpoint path without extension")
+
+    opt = parser.parse_args()
+    out_dir = opt.out_dir
+    if out_dir is None:
+        out_dir = opt.checkpoint
+        for ext in ['.tar', '.pth']:
+            if out_dir.endswith(ext):
+                out_dir = out_dir[:-len(ext)]
+
+    for name in convert_checkpoint(opt.checkpoint, out_dir):
+        print("%s -> %s" % (name, os.path.join(out_dir, name + '.bin')))
@@ -0,0 +1,99 @@
+import os
+import sys
+import json
+import yaml
+from argparse import ArgumentParser
+from multiprocessing import Pool
+
+import numpy as np
+from imageio import mimread
+from skimage import img_as_ubyte
+from tqdm import tqdm
+
+from frames_dataset import read_video, SHARD_INDEX
+from frame_resize import resize_frames, RESIZE_BACKENDS
+
+
+def decode_video(args):
+    path, source_frame_shape, frame_shape, resize_backend = args
+    if path.lower().endswith(('.gif', '.mp4', '.mov')):
+        # uint8 frames at their own size, resized once below
+        video = mimread(path)
+    else:
+        video = img_as_ubyte(read_video(path, frame_shape=source_frame_shape))
+    return resize_frames(video, frame_shape[:2], backend=resize_backend)
+
+
+def convert_dataset(root_dir, out_dir, frame_shape, source_frame_shape=None, shard_size=2 ** 30, n_workers=8,
+                    resize_backend='parity'):
+    """
+    Decode every video of a dataset root into uint8 frames of frame_shape, packed into .npy shards of about
+    shard_size bytes that FramesDataset memory maps. out_dir/shards.json records the shards and, for every
+    split ('train' and 'test' for a predefined split, 'all' otherwise), the shard, first frame and frame
+    count of each video. source_frame_shape is the dataset's frame_shape, needed for concatenated frames.
+    Frames are decoded at their own size and resized once with resize_backend, see frame_resize.
+    """
+    if os.path.exists(os.path.join(root_dir, 'train')):
+        splits = {split: os.path.join(root_dir, split) for split in ['train', 'test']}
+    else:
+        splits = {'all': root_dir}
+    os.makedirs(out_dir, exist_ok=True)
+
+    index = {'frame_shape': list(frame_shape[:2]) + [3], 'shards': [], 'splits': {}}
+    shard, shard_frames = [], 0
+    shard_frame_limit = max(1, shard_size // int(np.prod(index['frame_shape'])))
+
+    def flush():
+        name = 'shard_%05d.npy' % len(index['shards'])
+        np.save(os.path.join(out_dir, name), np.concatenate(shard))
+        index['shards'].append(name)
+
+    with Pool(n_workers) as pool:
+        for split, split_dir in splits.items():
+            names = sorted(os.listdir(split_dir))
+            tasks = [(os.path.join(split_dir, name), source_frame_shape, frame_shape, resize_backend)
+                     for name in names]
+            entries = []
+            for name, video in tqdm(zip(names, pool.imap(decode_video, tasks)), total=len(names), desc=split):
+                entries.append({'name': name, 'shard': len(index['shards']), 'start': shard_frames,
+                                'num_frames': len(video)})
+                shard.append(video)
+                shard_frames += len(video)
+                if shard_frames >= shard_frame_limit:
+                    flush()
+                    shard, shard_frames = [], 0
+            index['splits'][split] = entries
+    if shard:
+        flush()
+
+    with open(os.path.join(out_dir, SHARD_INDEX), 'w') as f:
+        json.dump(index, f)
+    return index
+
+
+if __name__ == "__main__":
+    if sys.version_info[0] < 3:
+        raise Exception("You must use Python 3 or higher. Recommended version is Python 3.9")
+
+    parser = ArgumentParser()
+    parser.add_argument("--config", default="config/vox-256.yaml", help="config whose dataset_params are converted")
+    parser.add_argument("--root_dir", default=None, help="dataset root, the config's root_dir by default")
+    parser.add_argument("--out_dir", required=True, help="output directory, use it as root_dir for training")
+    parser.add_argument("--frame_shape", default="256,256", type=lambda x: list(map(int, x.split(','))),
+                        help="stored frame size, the size the model is trained on")
+    parser.add_argument("--resize_backend", default='parity', choices=RESIZE_BACKENDS,
+                        help="backend resizing the decoded frames to frame_shape, see frame_resize.py")
+    parser.add_argument("--shard_size_mb", default=1024, type=int, help="approximate size of a shard")
+    parser.add_argument('-nw', "--n_workers", default=8, type=int, help="number of decoding processes")
+
+    opt = parser.parse_args()
+    with open(opt.config) as f:
+        dataset_params = yaml.full_load(f)['dataset_params']
+
+    index = convert_dataset(opt.root_dir or dataset_params['root_dir'], opt.out_dir, opt.frame_shape,
+                            source_frame_shape=dataset_params.get('frame_shape'),
+                            shard_size=opt.shard_size_mb * 2 ** 20, n_workers=opt.n_workers,
+                            resize_backend=opt.resize_backend)
+    for split, entries in index['splits'].items():
+        print("%s: %d videos, %d frames" % (split, len(entries), sum(entry['num_frames'] for entry in entries)))
+    print("%d shards in %s" % (len(index['shards']), opt.out_dir))
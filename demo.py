@@ -1,29 +1,29 @@
-import matplotlib
-matplotlib.use('Agg')
 import os
 import sys
 import yaml
+import json
 from argparse import ArgumentParser
 from tqdm import tqdm
-from scipy.spatial import ConvexHull
 import numpy as np
 # import imageio
 import imageio.v2 as imageio
-from skimage.transform import resize
 from skimage import img_as_ubyte
 import torch
+import torch.nn.functional as F
 from modules.inpainting_network import InpaintingNetwork
 from modules.keypoint_detector import KPDetector
 from modules.dense_motion import DenseMotionNetwork
 from modules.avd_network import AVDNetwork
+from modules.util import AntiAliasInterpolation2d
 
 from typing import List
-from functions import crop_face, replace, get_fa_kps, save_images
-import face_alignment
+from functions import crop_face, get_fa_kps, CropCompositor
+from frame_export import FrameExporter, frame_path, FRAME_FORMATS
+from frame_resize import resize_frames
 
 import gc
-
-from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import time
 
 gc.enable()
 
@@ -31,86 +31,693 @@ if sys.version_info[0] < 3:
     raise Exception("You must use Python 3 or higher. Recommended version is Python 3.9")
 
 
-def relative_kp(kp_source, kp_driving, kp_driving_initial):
+def adapt_movement_scale(kp_source, kp_driving_initial):
+    """
+    Ratio of the keypoint convex hull sizes of the source and of the initial driving frame.
+    It is constant for a video, so compute it once and pass it to relative_kp, the result stays on device.
+    """
+    from scipy.spatial import ConvexHull
 
     source_area = ConvexHull(kp_source['fg_kp'][0].data.cpu().numpy()).volume
     driving_area = ConvexHull(kp_driving_initial['fg_kp'][0].data.cpu().numpy()).volume
-    adapt_movement_scale = np.sqrt(source_area) / np.sqrt(driving_area)
+    scale = np.sqrt(source_area) / np.sqrt(driving_area)
+    return torch.tensor(scale, dtype=kp_source['fg_kp'].dtype, device=kp_source['fg_kp'].device)
+
+
+def relative_kp(kp_source, kp_driving, kp_driving_initial, movement_scale=None):
+    """
+    Move the source keypoints by the driving motion relative to the initial driving frame.
+    kp_driving may hold a whole stack of frames along the batch dimension, with movement_scale
+    given there is no host round-trip.
+    """
+    if movement_scale is None:
+        movement_scale = adapt_movement_scale(kp_source, kp_driving_initial)
 
     kp_new = {k: v for k, v in kp_driving.items()}
 
     kp_value_diff = (kp_driving['fg_kp'] - kp_driving_initial['fg_kp'])
-    kp_value_diff *= adapt_movement_scale
-    kp_new['fg_kp'] = kp_value_diff + kp_source['fg_kp']
+    kp_new['fg_kp'] = kp_value_diff * movement_scale + kp_source['fg_kp']
 
     return kp_new
 
 
+INFERENCE_NETWORKS = ['inpainting_network', 'kp_detector', 'dense_motion_network', 'avd_network']
+
+# the meta device context and load_state_dict(assign=True) need torch >= 2.1, before that the
+# networks are allocated without running their random initialization and the weights copied in
+META_LOADING = tuple(int(v) for v in torch.__version__.split('+')[0].split('.')[:2]) >= (2, 1)
+
+# the torch.nn.init functions called by reset_parameters of the layers used here and by torchvision's resnet
+SKIPPED_INIT_FUNCTIONS = ['uniform_', 'normal_', 'constant_', 'ones_', 'zeros_', 'kaiming_uniform_',
+                          'kaiming_normal_', 'xavier_uniform_', 'xavier_normal_', 'trunc_normal_']
+
+
+@contextlib.contextmanager
+def skip_weight_init():
+    """
+    Turn the torch.nn.init functions into no-ops, parameters created inside are left uninitialized.
+    """
+    saved = {name: getattr(torch.nn.init, name) for name in SKIPPED_INIT_FUNCTIONS}
+    try:
+        for name in saved:
+            setattr(torch.nn.init, name, lambda tensor, *args, **kwargs: tensor)
+        yield
+    finally:
+        for name, function in saved.items():
+            setattr(torch.nn.init, name, function)
+
+
+def build_networks(config, names=INFERENCE_NETWORKS, skip_init=False):
+    """
+    Build the inference networks from the config. With skip_init=True no random initialization is run and
+    weights have to be loaded afterwards, from torch 2.1 the parameters live on the meta device and no
+    memory is allocated either.
+    """
+    model_params = config['model_params']
+    factories = {
+        'inpainting_network': lambda: InpaintingNetwork(**model_params['generator_params'],
+                                                        **model_params['common_params']),
+        'kp_detector': lambda: KPDetector(**model_params['common_params']),
+        'dense_motion_network': lambda: DenseMotionNetwork(**model_params['common_params'],
+                                                           **model_params['dense_motion_params']),
+        'avd_network': lambda: AVDNetwork(num_tps=model_params['common_params']['num_tps'],
+                                          **model_params['avd_network_params']),
+    }
+    if not skip_init:
+        context = contextlib.nullcontext()
+    elif META_LOADING:
+        context = torch.device('meta')
+    else:
+        context = skip_weight_init()
+    with context:
+        return {name: factories[name]() for name in names}
+
+
+def load_weight_file(weights_dir, name):
+    """
+    State dict of a network written by convert_checkpoint.py, the tensors are copy-on-write views
+    of the memory mapped <name>.bin, so only the pages that are actually used get read.
+    """
+    with open(os.path.join(weights_dir, name + '.json')) as f:
+        layout = json.load(f)
+    data = np.memmap(os.path.join(weights_dir, name + '.bin'), dtype=np.uint8, mode='c')
+    state_dict = {}
+    for key, (dtype, shape, offset) in layout.items():
+        state_dict[key] = torch.from_numpy(np.ndarray(shape, dtype=np.dtype(dtype), buffer=data, offset=offset))
+    return state_dict
+
+
+def load_inference_weights(networks, weights_dir, device):
+    """
+    Load the per-network weight files written by convert_checkpoint.py into networks built with
+    skip_init=True. From torch 2.1 the memory mapped tensors are assigned, before they are copied.
+    """
+    for name, network in networks.items():
+        if not os.path.exists(os.path.join(weights_dir, name + '.bin')):
+            raise FileNotFoundError("Missing weights for %s in %s" % (name, weights_dir))
+        state_dict = load_weight_file(weights_dir, name)
+        if META_LOADING:
+            network.load_state_dict(state_dict, assign=True)
+        else:
+            network.load_state_dict(state_dict)
+        network.to(device)
+    return networks
+
+
 def load_checkpoints(config_path, checkpoint_path, device):
+    """
+    Load the inference networks, checkpoint_path is either a training checkpoint (.pth.tar) or a directory
+    written by convert_checkpoint.py, which is loaded without random init.
+    """
     with open(config_path) as f:
         config = yaml.full_load(f)
 
-    inpainting = InpaintingNetwork(**config['model_params']['generator_params'],
-                                   **config['model_params']['common_params'])
-    kp_detector = KPDetector(**config['model_params']['common_params'])
-    dense_motion_network = DenseMotionNetwork(**config['model_params']['common_params'],
-                                              **config['model_params']['dense_motion_params'])
-    avd_network = AVDNetwork(num_tps=config['model_params']['common_params']['num_tps'],
-                             **config['model_params']['avd_network_params'])
-    kp_detector.to(device)
-    dense_motion_network.to(device)
-    inpainting.to(device)
-    avd_network.to(device)
-       
-    checkpoint = torch.load(checkpoint_path, map_location=device)
- 
-    inpainting.load_state_dict(checkpoint['inpainting_network'])
-    kp_detector.load_state_dict(checkpoint['kp_detector'])
-    dense_motion_network.load_state_dict(checkpoint['dense_motion_network'])
-    if 'avd_network' in checkpoint:
-        avd_network.load_state_dict(checkpoint['avd_network'])
-    
-    inpainting.eval()
-    kp_detector.eval()
-    dense_motion_network.eval()
-    avd_network.eval()
-    
-    return inpainting, kp_detector, dense_motion_network, avd_network
-
-
-def make_animation(source_image, driving_video, inpainting_network, kp_detector, dense_motion_network, avd_network, device, mode='relative'):
-    assert mode in ['standard', 'relative', 'avd']
-    with torch.no_grad():
-        predictions = []
-        source = torch.tensor(source_image[np.newaxis].astype(np.float32)).permute(0, 3, 1, 2)
-        source = source.to(device)
-        driving = torch.tensor(np.array(driving_video)[np.newaxis].astype(np.float32)).permute(0, 4, 1, 2, 3).to(device)
-        kp_source = kp_detector(source)
-        kp_driving_initial = kp_detector(driving[:, :, 0])
-
-        for frame_idx in tqdm(range(driving.shape[2])):
-            driving_frame = driving[:, :, frame_idx]
-            driving_frame = driving_frame.to(device)
-            kp_driving = kp_detector(driving_frame)
-            if mode == 'standard':
-                kp_norm = kp_driving
-            elif mode == 'relative':
-                kp_norm = relative_kp(kp_source=kp_source, kp_driving=kp_driving,
-                                      kp_driving_initial=kp_driving_initial)
-            elif mode == 'avd':
-                kp_norm = avd_network(kp_source, kp_driving)
-            dense_motion = dense_motion_network(source_image=source, kp_driving=kp_norm,
-                                                kp_source=kp_source, bg_param=None,
-                                                dropout_flag=False)
-            out = inpainting_network(source, dense_motion)
-
-            predictions.append(np.transpose(out['prediction'].data.cpu().numpy(), [0, 2, 3, 1])[0])
-    return predictions
+    if checkpoint_path is not None and os.path.isdir(checkpoint_path):
+        names = [name for name in INFERENCE_NETWORKS
+                 if name != 'avd_network' or os.path.exists(os.path.join(checkpoint_path, name + '.bin'))]
+        networks = load_inference_weights(build_networks(config, names, skip_init=True), checkpoint_path, device)
+        if 'avd_network' not in networks:
+            # checkpoints trained without AVD keep the randomly initialized network, as below
+            networks.update(build_networks(config, ['avd_network']))
+            networks['avd_network'].to(device)
+    else:
+        networks = build_networks(config)
+        for network in networks.values():
+            network.to(device)
 
+        # checkpoint_path=None keeps the random weights, which is enough for timing runs
+        if checkpoint_path is not None:
+            checkpoint = torch.load(checkpoint_path, map_location=device)
 
-def find_best_frame(source, driving, cpu):
+            for name in INFERENCE_NETWORKS:
+                if name in checkpoint:
+                    networks[name].load_state_dict(checkpoint[name])
+                elif name != 'avd_network':
+                    raise KeyError("Checkpoint %s has no %s" % (checkpoint_path, name))
+
+    for network in networks.values():
+        network.eval()
+
+    return tuple(networks[name] for name in INFERENCE_NETWORKS)
+
+
+def frames_to_tensor(frames, device):
+    """
+    N x H x W x 3 frames to a float N x 3 x H x W tensor in [0, 1] on device. uint8 frames are wrapped
+    without a copy and normalized on the device, float frames in [0, 1] are accepted as well.
+    """
+    frames = torch.from_numpy(np.ascontiguousarray(frames)).to(device)
+    is_uint8 = frames.dtype == torch.uint8
+    frames = frames.float()
+    if is_uint8:
+        frames /= 255
+    return frames.permute(0, 3, 1, 2)
+
+
+def tensor_to_frames(prediction):
+    """
+    Quantize a float N x 3 x H x W prediction to uint8 on its device, returns N x H x W x 3 numpy frames.
+    Rounds like skimage's img_as_ubyte.
+    """
+    prediction = prediction.mul(255).round_().clamp_(0, 255).to(torch.uint8)
+    return prediction.permute(0, 2, 3, 1).cpu().numpy()
+
+
+def expand_kp(kp, bs):
+    return {k: v.expand(bs, *v.shape[1:]) for k, v in kp.items()}
+
+
+def make_animation(source_image, driving_video, inpainting_network, kp_detector, dense_motion_network, avd_network,
+                   device, mode='relative', batch_size=1, driving_initial=None, reuse_threshold=None,
+                   keyframe_interval=1, prune_threshold=None, quality='full', draft_scale=1.0, tile_size=None,
+                   tile_overlap=32, motion_shape=(256, 256)):
+    """
+    Animate source_image with every frame of driving_video, frames are uint8 (or float in [0, 1]) H x W x 3.
+    Driving frames go through the networks batch_size at a time, returns a list of uint8 H x W x 3 frames.
+    driving_initial is the frame relative motion is measured from, the first driving frame by default.
+    reuse_threshold enables frame reuse for near-static keypoints, keyframe_interval > 1 runs the keypoint
+    detector and the dense motion network on every keyframe_interval-th frame only, prune_threshold skips TPS transformations that do not contribute and
+    quality='draft' only warps the source, tile_size renders a source larger than motion_shape in tiles,
+    see StreamingAnimator.
+    """
+    if keyframe_interval > 1 and reuse_threshold is not None:
+        raise ValueError("reuse_threshold and keyframe_interval can't be combined")
+    animator = StreamingAnimator(source_image, inpainting_network, kp_detector, dense_motion_network, avd_network,
+                                 device=device, mode=mode, reuse_threshold=reuse_threshold,
+                                 prune_threshold=prune_threshold, quality=quality, draft_scale=draft_scale,
+                                 tile_size=tile_size, tile_overlap=tile_overlap, motion_shape=motion_shape)
+    if driving_initial is not None:
+        animator.set_initial_frame(driving_initial)
+    predictions = np.empty((len(driving_video),) + animator.frame_shape, dtype=np.uint8)
+    if keyframe_interval > 1:
+        # batch_size keyframes per pass, the first chunk also holds frame 0 so every chunk ends on the keyframe grid
+        chunk_size = batch_size * keyframe_interval
+        bounds = [0] + list(range(chunk_size + 1, len(driving_video), chunk_size)) + [len(driving_video)]
+        for start, end in tqdm(list(zip(bounds[:-1], bounds[1:]))):
+            predictions[start:end] = animator.render_keyframes(driving_video[start:end], keyframe_interval)
+    else:
+        for start in tqdm(range(0, len(driving_video), batch_size)):
+            batch = driving_video[start:(start + batch_size)]
+            predictions[start:(start + len(batch))] = animator.render(batch)
+    if reuse_threshold is not None:
+        print("Reused %d of %d frames" % (animator.num_reused, len(driving_video)))
+    if prune_threshold is not None:
+        print("Pruned %.1f%% of the TPS transformations" % (100 * animator.pruned_fraction()))
+    return list(predictions)
+
+
+def tile_starts(size, tile, overlap, align=1):
+    """
+    Offsets of tiles covering size with at least overlap pixels shared by neighbours, multiples of align.
+    """
+    if tile >= size:
+        return [0]
+    stride = max(align, (tile - overlap) // align * align)
+    return list(range(0, size - tile, stride)) + [size - tile]
+
+
+def tile_weights(h, w, overlap, device):
+    """
+    1 x 1 x h x w blending weights of a tile, ramping up linearly over overlap pixels from its borders.
+    """
+    ramp_y = torch.minimum(torch.arange(h, device=device), torch.arange(h, device=device).flip(0)) + 1
+    ramp_x = torch.minimum(torch.arange(w, device=device), torch.arange(w, device=device).flip(0)) + 1
+    weights = torch.minimum(ramp_y[:, None], ramp_x[None, :]).float() / (overlap + 1)
+    return weights.clamp_(max=1).view(1, 1, h, w)
+
+
+def resized_crop(field, size, top, left, h, w):
+    """
+    F.interpolate(field, size, mode='bilinear', align_corners=True)[:, :, top:top + h, left:left + w]
+    without resizing the whole field.
+    """
+    if (h, w) == tuple(size):
+        if tuple(field.shape[2:]) == tuple(size):
+            return field
+        return F.interpolate(field, size=size, mode='bilinear', align_corners=True)
+    # normalized coordinates of the crop pixels, align_corners maps the corners of both grids onto each other
+    grid_y = torch.arange(top, top + h, device=field.device, dtype=field.dtype) * 2 / (size[0] - 1) - 1
+    grid_x = torch.arange(left, left + w, device=field.device, dtype=field.dtype) * 2 / (size[1] - 1) - 1
+    grid = torch.stack([grid_x[None, :].expand(h, w), grid_y[:, None].expand(h, w)], dim=-1)
+    return F.grid_sample(field, grid[None].expand(field.shape[0], -1, -1, -1), mode='bilinear',
+                         align_corners=True)
+
+
+class StreamingAnimator:
+    """
+    Animate a source image from driving frames that arrive one at a time (webcam, socket, generator).
+    The source tensor, its keypoints and its encoder maps are computed once, the first driving frame
+    fixes kp_driving_initial for the relative mode.
+
+    With reuse_threshold set, a frame whose keypoints moved less than the threshold (mean distance in the
+    [-1, 1] keypoint coordinates) from the last rendered frame repeats that frame instead of running
+    the dense motion and inpainting networks.
+
+    With prune_threshold set, TPS transformations whose contribution map stays below the threshold
+    everywhere are skipped, the active set is measured on a full pass every prune_refresh frames.
+
+    quality='draft' is a preview tier: the source, downscaled by draft_scale, is warped with the dense motion
+    and weighted by the occlusion map, the inpainting network is not run at all.
+
+    With tile_size set, source_image can be larger than the model resolution motion_shape: keypoints and
+    dense motion are computed on the source resized to motion_shape, the inpainting network renders the
+    full resolution output in overlapping tile_size tiles blended over tile_overlap pixels. Every tile encodes
+    only the source region its motion points into, so peak memory follows the tile size plus the span of
+    that region, up to the whole source for large motions. The decoder's instance norms only see one tile,
+    so tiles differ from an untiled render and can show seams, which the blending softens.
+    """
+
+    def __init__(self, source_image, inpainting_network, kp_detector, dense_motion_network, avd_network,
+                 device, mode='relative', latency_budget=None, reuse_threshold=None, prune_threshold=None,
+                 prune_refresh=25, quality='full', draft_scale=1.0, tile_size=None, tile_overlap=32,
+                 motion_shape=(256, 256)):
+        assert quality in ['full', 'draft']
+        if tile_size is not None and quality == 'draft':
+            raise ValueError("Draft quality renders at the model resolution, it can't be tiled")
+        if tile_size is not None and not inpainting_network.multi_mask:
+            raise ValueError("Tiled inference needs an inpainting network with multi_mask")
+        assert mode in ['standard', 'relative', 'avd']
+        self.inpainting_network = inpainting_network
+        self.kp_detector = kp_detector
+        self.dense_motion_network = dense_motion_network
+        self.avd_network = avd_network
+        self.device = device
+        self.mode = mode
+        # per-frame latency budget in seconds, frames above it are counted in latency_stats
+        self.latency_budget = latency_budget
+        self.reuse_threshold = reuse_threshold
+        self.prune_threshold = prune_threshold
+        self.prune_refresh = prune_refresh
+        self.quality = quality
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+
+        with torch.no_grad():
+            self.source = frames_to_tensor(source_image[np.newaxis], device)
+            self.full_source = self.source
+            if tile_size is not None and tuple(self.source.shape[2:]) != tuple(motion_shape):
+                self.source = frames_to_tensor(resize_frames(source_image[np.newaxis], motion_shape), device)
+            self.kp_source = kp_detector(self.source)
+            if quality == 'draft':
+                self.draft_source = self.source
+                if draft_scale < 1:
+                    down = AntiAliasInterpolation2d(self.source.shape[1], draft_scale).to(device)
+                    self.draft_source = down(self.source)
+                elif draft_scale > 1:
+                    self.draft_source = F.interpolate(self.source, scale_factor=draft_scale, mode='bilinear',
+                                                      align_corners=False)
+            elif tile_size is not None and tile_size < max(self.full_source.shape[2:]):
+                # tiles need the size to divide down to every encoder level
+                align = 2 ** inpainting_network.num_down_blocks
+                h, w = self.full_source.shape[2:]
+                if h % align or w % align:
+                    raise ValueError("Tiled inference needs a source size divisible by %d, got %dx%d"
+                                     % (align, h, w))
+                # tiles encode their own source region with the statistics of the whole source
+                self.encoder_norm_stats = inpainting_network.encoder_norm_stats(self.full_source, tile_size)
+            else:
+                self.encoder_map = inpainting_network.encode_source(self.full_source)
+        output = self.draft_source if quality == 'draft' else self.full_source
+        self.frame_shape = tuple(output.shape[2:]) + (output.shape[1],)
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the initial driving frame and the latency history, e.g. when the driving stream restarts.
+        """
+        self.kp_driving_initial = None
+        self.movement_scale = None
+        self.latencies = []
+        # keypoints and output of the last rendered frame, for reuse_threshold
+        self.last_kp = None
+        self.last_prediction = None
+        self.num_reused = 0
+        # dense motion of the last keyframe, for render_keyframes
+        self.last_motion = None
+        # TPS transformations kept by prune_threshold, frames since they were measured, pruning counts
+        self.active_tps = None
+        self.frames_since_refresh = 0
+        self.num_pruned = 0
+        self.num_transformations = 0
+
+    def set_initial_kp(self, kp_driving_initial):
+        self.kp_driving_initial = kp_driving_initial
+        if self.mode == 'relative':
+            self.movement_scale = adapt_movement_scale(self.kp_source, kp_driving_initial)
+
+    def set_initial_frame(self, driving_frame):
+        """
+        Measure relative motion from driving_frame instead of the first rendered frame.
+        """
+        with torch.no_grad():
+            self.set_initial_kp(self.kp_detector(frames_to_tensor(driving_frame[np.newaxis], self.device)))
+
+    def normalize_kp(self, kp_driving):
+        """
+        Driving keypoints of a batch mapped onto the source according to the animation mode.
+        """
+        kp_source = expand_kp(self.kp_source, kp_driving['fg_kp'].shape[0])
+        if self.mode == 'standard':
+            return kp_driving
+        elif self.mode == 'relative':
+            return relative_kp(kp_source=kp_source, kp_driving=kp_driving,
+                               kp_driving_initial=self.kp_driving_initial, movement_scale=self.movement_scale)
+        elif self.mode == 'avd':
+            return self.avd_network(kp_source, kp_driving)
+
+    def motion(self, kp_norm):
+        """
+        Dense motion from the source to a batch of normalized driving keypoints.
+        """
+        bs = kp_norm['fg_kp'].shape[0]
+        refresh = self.active_tps is None or self.frames_since_refresh >= self.prune_refresh
+        active_tps = self.active_tps if self.prune_threshold is not None and not refresh else None
+        dense_motion = self.dense_motion_network(source_image=self.source.expand(bs, -1, -1, -1), kp_driving=kp_norm,
+                                                 kp_source=expand_kp(self.kp_source, bs), bg_param=None,
+                                                 dropout_flag=False, active_tps=active_tps)
+        if self.prune_threshold is not None:
+            num_tps = self.dense_motion_network.num_tps
+            if refresh:
+                # peak contribution of every TPS transformation over the batch, the background is always kept
+                peak = dense_motion['contribution_maps'][:, 1:].amax(dim=(0, 2, 3))
+                active = torch.nonzero(peak >= self.prune_threshold).flatten()
+                self.active_tps = (active if len(active) else peak.argmax().view(1)).tolist()
+                self.frames_since_refresh = 0
+            else:
+                self.frames_since_refresh += bs
+                self.num_pruned += bs * (num_tps - len(active_tps))
+            self.num_transformations += bs * num_tps
+        return dense_motion
+
+    def pruned_fraction(self):
+        """
+        Fraction of the TPS transformations skipped by prune_threshold since the last reset.
+        """
+        return self.num_pruned / self.num_transformations if self.num_transformations else 0.0
+
+    def decode(self, dense_motion):
+        """
+        Inpaint the warped cached source features, returns the float N x 3 x H x W prediction.
+        """
+        if self.quality == 'draft':
+            return self.draft(dense_motion)
+        if self.tile_size is not None:
+            return self.decode_tiled(dense_motion)
+        bs = dense_motion['deformation'].shape[0]
+        encoder_map = [feature_map.expand(bs, -1, -1, -1) for feature_map in self.encoder_map]
+        out = self.inpainting_network(self.source.expand(bs, -1, -1, -1), dense_motion, encoder_map=encoder_map)
+        return out['prediction']
+
+    def decode_tiled(self, dense_motion):
+        """
+        Inpaint the full resolution output tile by tile. Every tile crops the deformation and the occlusion map
+        of each encoder level to its area, as if they were resized to the full resolution levels, and warps
+        the source region they point into, see source_region. A single tile renders like decode.
+        """
+        bs = dense_motion['deformation'].shape[0]
+        _, channels, h, w = self.full_source.shape
+        num_down_blocks = self.inpainting_network.num_down_blocks
+        align = 2 ** num_down_blocks
+        tile_h, tile_w = [max(align, min(self.tile_size, size) // align * align) for size in (h, w)]
+        starts_y = tile_starts(h, tile_h, self.tile_overlap, align)
+        starts_x = tile_starts(w, tile_w, self.tile_overlap, align)
+
+        deformation = dense_motion['deformation'].permute(0, 3, 1, 2)
+        occlusion_map = dense_motion['occlusion_map']
+        prediction = torch.zeros(bs, channels, h, w, device=self.device)
+        weights = torch.zeros(1, 1, h, w, device=self.device)
+        for y in starts_y:
+            for x in starts_x:
+                # the tile on every encoder level, finest first
+                crops = [((h >> level, w >> level), y >> level, x >> level, tile_h >> level, tile_w >> level)
+                         for level in range(num_down_blocks + 1)]
+                deformations = [resized_crop(deformation, *crop).permute(0, 2, 3, 1) for crop in crops]
+                tile_motion = {
+                    # occlusion_map[i] belongs to the encoder level num_down_blocks - i
+                    'occlusion_map': [resized_crop(occlusion, *crops[num_down_blocks - i])
+                                      for i, occlusion in enumerate(occlusion_map)],
+                    'contribution_maps': None,
+                    'deformed_source': None,
+                }
+                if len(starts_y) == 1 and len(starts_x) == 1:
+                    tile_motion['deformation'] = deformations
+                    encoder_map = [feature_map.expand(bs, -1, -1, -1) for feature_map in self.encoder_map]
+                    return self.inpainting_network(self.full_source.expand(bs, -1, -1, -1), tile_motion,
+                                                   encoder_map=encoder_map)['prediction']
+                source, encoder_map, tile_motion['deformation'] = self.source_region(deformations)
+                encoder_map = [feature_map.expand(bs, -1, -1, -1) for feature_map in encoder_map]
+                tile = self.inpainting_network(source.expand(bs, -1, -1, -1), tile_motion,
+                                               encoder_map=encoder_map)['prediction']
+                weight = tile_weights(tile_h, tile_w, self.tile_overlap, self.device)
+                prediction[:, :, y:(y + tile_h), x:(x + tile_w)] += tile * weight
+                weights[:, :, y:(y + tile_h), x:(x + tile_w)] += weight
+        return prediction / weights
+
+    def source_region(self, deformations):
+        """
+        Crop of the full source that per-level deformations of a tile sample from, its encoder maps and the
+        deformations remapped into the crop. The crop is encoded with a halo covering the receptive field
+        of the encoder and the instance norm statistics of the whole source, so it matches encode_source.
+        """
+        _, _, h, w = self.full_source.shape
+        align = 2 ** self.inpainting_network.num_down_blocks
+        # sampled pixels of every level in full resolution pixels, bilinear reads the next pixel as well
+        region = []
+        for axis, size in ((1, h), (0, w)):
+            low, high = size, 0
+            for level, deformation in enumerate(deformations):
+                coords = (deformation[..., axis] + 1) / 2 * ((size >> level) - 1)
+                low = min(low, int(coords.min().floor()) << level)
+                high = max(high, (int(coords.max().floor()) + 2) << level)
+            low = min(max(low, 0), size) // align * align
+            high = -(-min(max(high, 0), size) // align) * align
+            # at least two pixels on the deepest level for the remapped coordinates
+            high = max(high, low + 2 * align)
+            if high > size:
+                low, high = size - 2 * align, size
+            region.append((low, high))
+        (top, bottom), (left, right) = region
+
+        halo = self.inpainting_network.encoder_halo()
+        crop_top, crop_left = max(top - halo, 0), max(left - halo, 0)
+        crop = self.full_source[:, :, crop_top:min(bottom + halo, h), crop_left:min(right + halo, w)]
+        encoder_map = []
+        for level, feature_map in enumerate(self.inpainting_network.encode_crop(crop, self.encoder_norm_stats)):
+            offset_y, offset_x = (top - crop_top) >> level, (left - crop_left) >> level
+            encoder_map.append(feature_map[:, :, offset_y:(offset_y + ((bottom - top) >> level)),
+                                           offset_x:(offset_x + ((right - left) >> level))])
+
+        remapped = []
+        for level, deformation in enumerate(deformations):
+            axes = []
+            for axis, size, start, end in ((0, w, left, right), (1, h, top, bottom)):
+                coords = (deformation[..., axis] + 1) / 2 * ((size >> level) - 1) - (start >> level)
+                axes.append(coords * 2 / (((end - start) >> level) - 1) - 1)
+            remapped.append(torch.stack(axes, dim=-1))
+        return self.full_source[:, :, top:bottom, left:right], encoder_map, remapped
+
+    def draft(self, dense_motion):
+        """
+        Preview prediction, the (downscaled) source warped by the dense motion and weighted by the occlusion map.
+        """
+        bs = dense_motion['deformation'].shape[0]
+        deformed = self.inpainting_network.deform_input(self.draft_source.expand(bs, -1, -1, -1),
+                                                        dense_motion['deformation'])
+        occlusion = F.interpolate(dense_motion['occlusion_map'][-1], size=deformed.shape[2:], mode='bilinear',
+                                  align_corners=True)
+        return deformed * occlusion
+
+    def interpolate_motion(self, keyframe_motion, previous, following, weights):
+        """
+        Dense motion of in-between frames, a linear blend of the deformation and occlusion maps of the keyframes
+        previous[i] and following[i] of keyframe_motion, weights[i] is the share of following[i].
+        """
+        weights = torch.tensor(weights, dtype=keyframe_motion['deformation'].dtype, device=self.device)
+
+        def blend(a, b, w):
+            return a * (1 - w) + b * w
+
+        return {
+            'deformation': blend(keyframe_motion['deformation'][previous], keyframe_motion['deformation'][following],
+                                 weights.view(-1, 1, 1, 1)),
+            'occlusion_map': [blend(occlusion[previous], occlusion[following], weights.view(-1, 1, 1, 1))
+                              for occlusion in keyframe_motion['occlusion_map']],
+            'contribution_maps': None,
+            'deformed_source': None,
+        }
+
+    def render_keyframes(self, driving_frames, interval):
+        """
+        Render every interval-th driving frame (and the last one) in full, the frames in between decode
+        an interpolation of the dense motion of the surrounding keyframes, so they skip the keypoint
+        detector and the dense motion network. The inpainting network still runs on every frame, it bounds
+        the speedup. Consecutive calls continue the keyframe grid.
+        """
+        num_frames = len(driving_frames)
+        first = interval - 1 if self.last_motion is not None else 0
+        keyframes = list(range(first, num_frames, interval))
+        if not keyframes or keyframes[-1] != num_frames - 1:
+            keyframes.append(num_frames - 1)
+
+        with torch.no_grad():
+            driving = frames_to_tensor(np.asarray([driving_frames[i] for i in keyframes]), self.device)
+            kp_driving = self.kp_detector(driving)
+            if self.kp_driving_initial is None:
+                self.set_initial_kp({k: v[:1] for k, v in kp_driving.items()})
+            motion = self.motion(self.normalize_kp(kp_driving))
+            predictions = np.empty((num_frames,) + self.frame_shape, dtype=np.uint8)
+            predictions[keyframes] = tensor_to_frames(self.decode(motion))
+
+            # the last keyframe of the previous call opens the grid at position -1
+            if self.last_motion is not None:
+                keyframes = [-1] + keyframes
+                motion = {
+                    'deformation': torch.cat([self.last_motion['deformation'], motion['deformation']]),
+                    'occlusion_map': [torch.cat([last, occlusion]) for last, occlusion in
+                                      zip(self.last_motion['occlusion_map'], motion['occlusion_map'])],
+                }
+            between, previous, following, weights = [], [], [], []
+            for k in range(len(keyframes) - 1):
+                for i in range(keyframes[k] + 1, keyframes[k + 1]):
+                    between.append(i)
+                    previous.append(k)
+                    following.append(k + 1)
+                    weights.append((i - keyframes[k]) / (keyframes[k + 1] - keyframes[k]))
+            if between:
+                interpolated = self.interpolate_motion(motion, previous, following, weights)
+                predictions[between] = tensor_to_frames(self.decode(interpolated))
+
+            self.last_motion = {'deformation': motion['deformation'][-1:],
+                                'occlusion_map': [occlusion[-1:] for occlusion in motion['occlusion_map']]}
+        return predictions
+
+    def select_rendered(self, fg_kp):
+        """
+        Indices of the frames of a batch to render, and for every frame the index of the rendered frame
+        it shows, -1 standing for the last frame rendered before the batch.
+        """
+        fg_kp = fg_kp.float().cpu()
+        rendered, shown = [], []
+        for i in range(fg_kp.shape[0]):
+            if self.last_kp is None or (fg_kp[i] - self.last_kp).norm(dim=-1).mean() >= self.reuse_threshold:
+                rendered.append(i)
+                self.last_kp = fg_kp[i]
+            shown.append(rendered[-1] if rendered else -1)
+        return rendered, shown
+
+    def render(self, driving_frames):
+        """
+        Render a batch of N x H x W x 3 driving frames in a single pass through the networks,
+        returns N x H x W x 3 uint8 predictions.
+        """
+        with torch.no_grad():
+            driving = frames_to_tensor(driving_frames, self.device)
+            kp_driving = self.kp_detector(driving)
+            if self.kp_driving_initial is None:
+                self.set_initial_kp({k: v[:1] for k, v in kp_driving.items()})
+            kp_norm = self.normalize_kp(kp_driving)
+
+            if self.reuse_threshold is None:
+                return tensor_to_frames(self.decode(self.motion(kp_norm)))
+
+            rendered, shown = self.select_rendered(kp_norm['fg_kp'])
+            predictions = np.empty((driving.shape[0],) + self.frame_shape, dtype=np.uint8)
+            if rendered:
+                kp_rendered = {k: v[rendered] for k, v in kp_norm.items()}
+                predictions[rendered] = tensor_to_frames(self.decode(self.motion(kp_rendered)))
+            for i, j in enumerate(shown):
+                if i != j:
+                    predictions[i] = self.last_prediction if j < 0 else predictions[j]
+            self.num_reused += len(shown) - len(rendered)
+            self.last_prediction = predictions[rendered[-1]].copy() if rendered else self.last_prediction
+            return predictions
+
+    def __call__(self, driving_frame):
+        """
+        Render a single H x W x 3 driving frame, returns the uint8 H x W x 3 prediction.
+        """
+        start = time.perf_counter()
+        # the copy to host in render waits for the device, so the timing covers the whole frame
+        prediction = self.render(driving_frame[np.newaxis])[0]
+        self.latencies.append(time.perf_counter() - start)
+        return prediction
+
+    def stream(self, driving_frames):
+        """
+        Lazily render every frame of an iterator of driving frames.
+        """
+        for driving_frame in driving_frames:
+            yield self(driving_frame)
+
+    def latency_stats(self):
+        """
+        p50/p99/mean per-frame latency in milliseconds over the frames rendered since the last reset.
+        """
+        if not self.latencies:
+            return {'num_frames': 0}
+        latencies = np.array(self.latencies) * 1000
+        stats = {
+            'num_frames': len(latencies),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'mean_ms': float(latencies.mean()),
+            'fps': float(1000 / latencies.mean()),
+        }
+        if self.latency_budget is not None:
+            stats['over_budget'] = int((latencies > self.latency_budget * 1000).sum())
+        return stats
+
+
+FACE_ALIGNMENT = {}
+SOURCE_LANDMARKS = {}
+
+
+def get_face_alignment(device):
+    """
+    One face_alignment model per device, loading it is expensive.
+    """
     import face_alignment
 
+    device = str(device)
+    if device not in FACE_ALIGNMENT:
+        FACE_ALIGNMENT[device] = face_alignment.FaceAlignment(face_alignment.LandmarksType._2D, flip_input=True,
+                                                              device=device)
+    return FACE_ALIGNMENT[device]
+
+
+def source_face_landmarks(image_path, image, device):
+    """
+    Facial landmarks of a source image, cached per file path and modification time.
+    """
+    key = (os.path.abspath(image_path), os.path.getmtime(image_path))
+    if key not in SOURCE_LANDMARKS:
+        SOURCE_LANDMARKS[key] = get_fa_kps(image, get_face_alignment(device))
+    return SOURCE_LANDMARKS[key]
+
+
+def find_best_frame(source, driving, cpu):
+    from scipy.spatial import ConvexHull
+
     def normalize_kp(kp):
         kp = kp - kp.mean(axis=0, keepdims=True)
         area = ConvexHull(kp[:, :2]).volume
@@ -118,15 +725,14 @@ def find_best_frame(source, driving, cpu):
         kp[:, :2] = kp[:, :2] / area
         return kp
 
-    fa = face_alignment.FaceAlignment(face_alignment.LandmarksType._2D, flip_input=True,
-                                      device='cpu' if cpu else 'cuda')
-    kp_source = fa.get_landmarks(255 * source)[0]
+    fa = get_face_alignment('cpu' if cpu else 'cuda')
+    kp_source = fa.get_landmarks(img_as_ubyte(source))[0]
     kp_source = normalize_kp(kp_source)
     norm = float('inf')
     frame_num = 0
     for i, image in tqdm(enumerate(driving)):
         try:
-            kp_driving = fa.get_landmarks(255 * image)[0]
+            kp_driving = fa.get_landmarks(img_as_ubyte(image))[0]
             kp_driving = normalize_kp(kp_driving)
             new_norm = (np.abs(kp_source - kp_driving) ** 2).sum()
             if new_norm < norm:
@@ -137,18 +743,80 @@ def find_best_frame(source, driving, cpu):
     return frame_num
 
 
-def load_video(video, img_shape):
+def resize_frame(frame, img_shape, backend='parity'):
+    """
+    Resize a decoded frame to img_shape, keeping it as uint8 H x W x 3.
+    """
+    return resize_frames(frame[np.newaxis], img_shape, backend=backend)[0]
+
+
+def load_video(video, img_shape, resize_backend='parity'):
+    """
+    Decode a video into a T x H x W x 3 uint8 array resized to img_shape, returns it with the fps.
+    See frame_resize.py for the resize backends.
+    """
     reader = imageio.get_reader(video)
     fps = reader.get_meta_data()['fps']
-    video = []
+    frames = []
     try:
         for im in reader:
-            video.append(im)
+            frames.append(im)
     except RuntimeError:
         pass
     reader.close()
 
-    return [resize(frame, img_shape)[..., :3] for frame in video], fps
+    return resize_frames(frames, img_shape, backend=resize_backend), fps
+
+
+def load_video_frames(video, frame_indices, img_shape, resize_backend='parity'):
+    """
+    Decode only frame_indices (sorted) and the first frame of a video, seeking instead of decoding
+    everything. Returns the frames as in load_video, the first frame and the fps.
+    """
+    reader = imageio.get_reader(video)
+    fps = reader.get_meta_data()['fps']
+    decoded = {}
+    try:
+        # ffmpeg counts the frames by demuxing only, before anything is decoded
+        check_frame_indices(frame_indices, reader.count_frames() if hasattr(reader, 'count_frames')
+                            else reader.get_length())
+        for idx in sorted(set([0] + list(frame_indices))):
+            decoded[idx] = reader.get_data(idx)
+    except IndexError:
+        raise IndexError("Frame %d is out of range for %s" % (idx, video))
+    finally:
+        reader.close()
+
+    frames = resize_frames([decoded[idx] for idx in frame_indices], img_shape, backend=resize_backend)
+    return frames, resize_frame(decoded[0], img_shape, backend=resize_backend), fps
+
+
+def frame_selection(selected_frames=None, frame_range=None):
+    """
+    Sorted driving frame indices from a list of frames and/or a (start, stop[, stride]) range, None if neither is set.
+    """
+    if not selected_frames and not frame_range:
+        return None
+    indices = set(selected_frames or [])
+    if frame_range:
+        indices.update(range(*frame_range))
+    indices = sorted(indices)
+    check_frame_indices(indices)
+    return indices
+
+
+def check_frame_indices(frame_indices, num_frames=None):
+    """
+    Reject an empty frame selection and indices that are negative or, with num_frames given, past the end of the video.
+    """
+    if not frame_indices:
+        raise ValueError("The frame selection is empty")
+    invalid = [idx for idx in frame_indices if idx < 0 or (num_frames is not None and idx >= num_frames)]
+    if invalid and num_frames is None:
+        raise ValueError("Selected frames %s are negative" % ', '.join(map(str, invalid)))
+    if invalid:
+        raise ValueError("Selected frames %s are out of range for a driving video of %d frames"
+                         % (', '.join(map(str, invalid)), num_frames))
 
 
 def inference(
@@ -162,13 +830,27 @@ def inference(
         img_shape,
         fps,
         mode,
+        reuse_threshold=None,
+        keyframe_interval=1,
+        prune_threshold=None,
+        quality='full',
+        draft_scale=1.0,
+        tile_size=None,
+        tile_overlap=32,
         is_find_best_frame=False,
         cpu=False,
         save_as_frames=False,
         selected_frames: List[int] = None,
+        frame_indices: List[int] = None,
+        driving_initial=None,
         crop_replace=False,
         crop_size=256,
-        n_workers=8
+        crop_feather=0,
+        n_workers=8,
+        batch_size=1,
+        frame_format='png',
+        png_compression=3,
+        jpeg_quality=95
 ):
     """ inference on single image
 
@@ -182,13 +864,28 @@ def inference(
     :param img_shape:
     :param fps:
     :param mode:
+    :param reuse_threshold: repeat the last rendered frame while the keypoints move less than this
+    :param keyframe_interval: estimate the motion on every n-th frame only and interpolate it in between,
+        the inpainting network still renders every frame
+    :param prune_threshold: skip the TPS transformations whose contribution maps stay below this
+    :param quality: 'full', or 'draft' to only warp the source for a quick preview
+    :param draft_scale: output scale of draft previews
+    :param tile_size: keep the source resolution and run the inpainting network in tiles of this size
+    :param tile_overlap: overlap in pixels of neighbouring tiles, blended linearly
     :param is_find_best_frame:
     :param cpu:
     :param save_as_frames:
-    :param selected_frames:
+    :param selected_frames: render and save only these frames of driving_video
+    :param frame_indices: original index of every frame in driving_video when it only holds a selection
+    :param driving_initial: first frame of the driving video when driving_video only holds a selection
     :param crop_replace:
     :param crop_size:
+    :param crop_feather: width in pixels of the blend between the rendered crop and the original image
     :param n_workers:
+    :param batch_size: number of driving frames per forward pass
+    :param frame_format: 'png' or 'jpg' for save_as_frames
+    :param png_compression: zlib level 0-9 of saved png frames
+    :param jpeg_quality: quality 1-100 of saved jpg frames
     :return:
     """
     if cpu:
@@ -203,9 +900,11 @@ def inference(
 
     if crop_replace:
         print("cropping images based on facial key points")
-        fa = face_alignment.FaceAlignment(face_alignment.LandmarksType._2D, flip_input=True, device="cuda")
+        fa_kps = source_face_landmarks(source_image, original_image, device)
+        if fa_kps is None:
+            raise ValueError("No face found in %s, it can't be used with crop_replace" % source_image)
         fa_id = [27, 30, 57, 8, 0, 16]
-        fa_kps = get_fa_kps(original_image, fa)[fa_id, :]
+        fa_kps = fa_kps[fa_id, :]
 
         # crop
         x, y = int((fa_kps[4, 0]+fa_kps[5, 0])/2), int((fa_kps[0,1]+fa_kps[1,1])/2)
@@ -215,30 +914,62 @@ def inference(
         source_image, top_left = crop_face(original_image, (x, y),
                                            off_x=crop_size//2, off_y=crop_size//2, size=crop_size)
         imageio.imsave(os.path.join(result_dir, crop_image_name), source_image)
-        source_image = resize(source_image, img_shape)[..., :3]
+        compositor = CropCompositor(original_image, top_left, source_image.shape[:2], feather=crop_feather)
     else:
-        source_image = resize(original_image, img_shape)[..., :3]
+        source_image = original_image
+    if tile_size is not None:
+        # the full resolution is kept, rounded down to what the inpainting network can tile
+        align = 2 ** inpainting.num_down_blocks
+        source_image = resize_frame(source_image, (source_image.shape[0] // align * align,
+                                                   source_image.shape[1] // align * align))
+    else:
+        source_image = resize_frame(source_image, img_shape)
+
+    if selected_frames and frame_indices is None:
+        # render only the selected frames of an already decoded video
+        frame_indices = sorted(set(selected_frames))
+        check_frame_indices(frame_indices, len(driving_video))
+        driving_initial = driving_video[0]
+        driving_video = [driving_video[idx] for idx in frame_indices]
 
     if is_find_best_frame:
+        if frame_indices is not None:
+            raise ValueError("find_best_frame needs every driving frame, it can't be used with a frame selection")
         i = find_best_frame(source_image, driving_video, cpu)
         print("Best frame: " + str(i))
         driving_forward = driving_video[i:]
         driving_backward = driving_video[:(i + 1)][::-1]
         predictions_forward = make_animation(source_image, driving_forward, inpainting, kp_detector,
-                                             dense_motion_network, avd_network, device=device, mode=mode)
+                                             dense_motion_network, avd_network, device=device, mode=mode,
+                                             batch_size=batch_size, reuse_threshold=reuse_threshold,
+                                             keyframe_interval=keyframe_interval,
+                                             prune_threshold=prune_threshold, quality=quality,
+                                             draft_scale=draft_scale, tile_size=tile_size,
+                                             tile_overlap=tile_overlap, motion_shape=img_shape)
         predictions_backward = make_animation(source_image, driving_backward, inpainting, kp_detector,
-                                              dense_motion_network, avd_network, device=device, mode=mode)
+                                              dense_motion_network, avd_network, device=device, mode=mode,
+                                              batch_size=batch_size, reuse_threshold=reuse_threshold,
+                                              keyframe_interval=keyframe_interval,
+                                              prune_threshold=prune_threshold, quality=quality,
+                                              draft_scale=draft_scale, tile_size=tile_size,
+                                              tile_overlap=tile_overlap, motion_shape=img_shape)
         predictions = predictions_backward[::-1] + predictions_forward[1:]
     else:
         predictions = make_animation(source_image, driving_video, inpainting, kp_detector,
-                                     dense_motion_network, avd_network, device=device, mode=mode)
-
-    frames = [img_as_ubyte(frame) for frame in predictions]
+                                     dense_motion_network, avd_network, device=device, mode=mode,
+                                     batch_size=batch_size, driving_initial=driving_initial,
+                                     reuse_threshold=reuse_threshold, keyframe_interval=keyframe_interval,
+                                     prune_threshold=prune_threshold, quality=quality, draft_scale=draft_scale,
+                                     tile_size=tile_size, tile_overlap=tile_overlap, motion_shape=img_shape)
 
     if crop_replace:
-        frames = [replace(original_image, repl_img=frame, top_left_point=top_left, size=crop_size) for frame in frames]
+        # composites share one canvas, they are consumed by the writers before the next one is pasted
+        frames = (frame for start in range(0, len(predictions), batch_size)
+                  for frame in compositor.composite(predictions[start:(start + batch_size)]))
+    else:
+        frames = iter(predictions)
 
-    imageio.mimsave(result_video, frames, fps=fps)
+    exporter = None
     if save_as_frames:
         postfix = '-frames' if not crop_replace else '-cr-frames'
         frame_dir = os.path.join(
@@ -246,21 +977,26 @@ def inference(
             os.path.splitext(os.path.basename(result_video))[0] + postfix
         )
         os.makedirs(frame_dir, exist_ok=True)
+        exporter = FrameExporter(n_workers=min(n_workers, len(predictions)), frame_format=frame_format,
+                                 png_compression=png_compression, jpeg_quality=jpeg_quality)
 
-        if selected_frames:
-            for idx in selected_frames:
-                imageio.imsave(os.path.join(frame_dir, f"{str(idx).zfill(3)}.png"), frames[idx])
-            return
-
-        # for i, im in tqdm(enumerate(frames)):
-        #     imageio.imsave(os.path.join(frame_dir, f"{str(i).zfill(3)}.png"), im)
-        filepath_list = [os.path.join(frame_dir, f"{str(i).zfill(3)}.png") for i in range(len(frames))]
-        # n_workers = 8
-        chunksize = round(len(filepath_list) / n_workers)
-        with ProcessPoolExecutor(n_workers) as exe:
-            for i in tqdm(range(0, len(filepath_list), chunksize)):
-                # fp_list = filepath_list[i: (i+chunksize)]
-                _ = exe.submit(save_images, frames[i: i+chunksize], filepath_list[i: (i+chunksize)])
+    names = frame_indices if frame_indices is not None else range(len(predictions))
+    if frame_indices is not None:
+        print("Warning: %s only holds the %d selected frames, played at the %g fps of the driving video, "
+              "--save_as_frames also saves them as images numbered like the driving frames"
+              % (result_video, len(frame_indices), fps))
+    # the exporter stops its workers and frees its shared memory on errors too
+    with imageio.get_writer(result_video, fps=fps) as writer, \
+            exporter if exporter is not None else contextlib.nullcontext():
+        for name, frame in zip(names, frames):
+            writer.append_data(frame)
+            if exporter is not None:
+                exporter.submit(frame, frame_path(frame_dir, name, frame_format))
+
+    if exporter is not None:
+        stats = exporter.stats
+        print("Saved %d frames in %.2fs (%.1f frames/s, %.1f MB/s)" % (
+            stats['frames'], stats['seconds'], stats['fps'], stats['MB/s']))
 
     del predictions
 
@@ -273,9 +1009,19 @@ def inference_func(args):
         config_path=args.config, checkpoint_path=args.checkpoint,
         device=torch.device('cpu') if args.cpu else torch.device('cuda')
     )
+    if args.tps_stride is not None:
+        dense_motion_network.tps_stride = args.tps_stride
 
-    # load driving video
-    driving_video, fps = load_video(args.driving_video, img_shape=args.img_shape)
+    # load driving video, only the selected frames if there is a selection
+    frame_indices = frame_selection(args.selected_frames, args.frame_range)
+    driving_initial = None
+    if frame_indices is not None:
+        driving_video, driving_initial, fps = load_video_frames(args.driving_video, frame_indices,
+                                                                img_shape=args.img_shape,
+                                                                resize_backend=args.resize_backend)
+    else:
+        driving_video, fps = load_video(args.driving_video, img_shape=args.img_shape,
+                                        resize_backend=args.resize_backend)
 
     if args.image_dir and os.path.isdir(args.image_dir):
         images = sorted(os.listdir(args.image_dir))
@@ -303,13 +1049,26 @@ def inference_func(args):
                 img_shape=args.img_shape,
                 fps=fps,
                 mode=args.mode,
+                reuse_threshold=args.reuse_threshold,
+                keyframe_interval=args.keyframe_interval,
+                prune_threshold=args.prune_threshold,
+                quality=args.quality,
+                draft_scale=args.draft_scale,
+                tile_size=args.tile_size,
+                tile_overlap=args.tile_overlap,
                 is_find_best_frame=args.find_best_frame,
                 cpu=args.cpu,
                 save_as_frames=args.save_as_frames,
-                selected_frames=args.selected_frames,
+                frame_indices=frame_indices,
+                driving_initial=driving_initial,
                 crop_replace=args.crop_replace,
                 crop_size=args.crop_size,
+                crop_feather=args.crop_feather,
                 n_workers=args.n_workers,
+                batch_size=args.batch_size,
+                frame_format=args.frame_format,
+                png_compression=args.png_compression,
+                jpeg_quality=args.jpeg_quality,
             )
     else:
         # single source image inference
@@ -324,13 +1083,26 @@ def inference_func(args):
             img_shape=args.img_shape,
             fps=fps,
             mode=args.mode,
+            reuse_threshold=args.reuse_threshold,
+            keyframe_interval=args.keyframe_interval,
+            prune_threshold=args.prune_threshold,
+            quality=args.quality,
+            draft_scale=args.draft_scale,
+            tile_size=args.tile_size,
+            tile_overlap=args.tile_overlap,
             is_find_best_frame=args.find_best_frame,
             cpu=args.cpu,
             save_as_frames=args.save_as_frames,
-            selected_frames=args.selected_frames,
+            frame_indices=frame_indices,
+            driving_initial=driving_initial,
             crop_replace=args.crop_replace,
             crop_size=args.crop_size,
+            crop_feather=args.crop_feather,
             n_workers=args.n_workers,
+            batch_size=args.batch_size,
+            frame_format=args.frame_format,
+            png_compression=args.png_compression,
+            jpeg_quality=args.jpeg_quality,
         )
 
 
@@ -349,10 +1121,38 @@ if __name__ == "__main__":
     parser.add_argument("--img_shape", default="256,256", type=lambda x: list(map(int, x.split(','))),
                         help='Shape of image, that the model was trained on.')
     
+    parser.add_argument("--resize_backend", default='parity', choices=['parity', 'torch', 'cv2', 'skimage'],
+                        help="resize backend for the driving video, 'parity' matches skimage, see frame_resize.py")
+
     parser.add_argument("--mode", default='relative', choices=['standard', 'relative', 'avd'],
                         help="Animate mode: ['standard', 'relative', 'avd'], when use the relative mode to animate "
                              "a face, use '--find_best_frame' can get better quality result")
     
+    parser.add_argument("--reuse_threshold", default=None, type=float,
+                        help="repeat the last rendered frame while the mean keypoint displacement from it stays "
+                             "below this value (keypoints are in [-1, 1]), e.g. 0.005")
+
+    parser.add_argument("-ki", "--keyframe_interval", default=1, type=int,
+                        help="run the keypoint detector and the dense motion network on every n-th frame only "
+                             "and interpolate the dense motion in between, the inpainting network still renders "
+                             "every frame, for high fps driving videos")
+
+    parser.add_argument("--quality", default='full', choices=['full', 'draft'],
+                        help="'draft' skips the inpainting network and shows the warped source, for quick previews")
+    parser.add_argument("--draft_scale", default=1.0, type=float, help="output scale of the draft quality")
+
+    parser.add_argument("--tile_size", default=None, type=int,
+                        help="render at the source resolution, running the inpainting network in tiles of this size, "
+                             "the tile borders may show seams")
+    parser.add_argument("--tile_overlap", default=32, type=int, help="overlap in pixels of neighbouring tiles")
+
+    parser.add_argument("--prune_threshold", default=None, type=float,
+                        help="skip the TPS transformations whose contribution maps stay below this value, e.g. 0.01")
+
+    parser.add_argument("--tps_stride", default=None, type=int,
+                        help="evaluate the TPS warps on a grid this many times coarser and upsample them, "
+                             "speeds up large resolutions, defaults to tps_stride in dense_motion_params")
+
     parser.add_argument("--find_best_frame", dest="find_best_frame", action="store_true", 
                         help="Generate from the frame that is the most alligned with source. "
                              "(Only for faces, requires face_aligment lib)")
@@ -360,12 +1160,22 @@ if __name__ == "__main__":
     parser.add_argument("--cpu", dest="cpu", action="store_true", help="cpu mode.")
 
     parser.add_argument("-saf", "--save_as_frames", action="store_true", help="same frames instead of video")
-    parser.add_argument("-sf", "--selected_frames", nargs='+', type=lambda x: list(map(int, x)),
-                        help="a list of frame index of the frames to save as image")
+    parser.add_argument("-sf", "--selected_frames", nargs='+', type=int,
+                        help="render only these driving frames, the result video only holds them "
+                             "(and save them as images with --save_as_frames)")
+    parser.add_argument("-fr", "--frame_range", type=lambda x: list(map(int, x.split(','))),
+                        help="render only the driving frames in range start,stop[,stride], "
+                             "the result video only holds them")
 
     parser.add_argument('-cr', "--crop_replace", action="store_true", help="crop and replace method")
     parser.add_argument('-cs', "--crop_size", default=256, type=int, help="size of cropped out image")
+    parser.add_argument('-cf', "--crop_feather", default=0, type=int,
+                        help="blend the pasted crop into the original image over this many pixels")
     parser.add_argument('-nw', "--n_workers", default=8, type=int, help="number of processes for save images")
+    parser.add_argument("--frame_format", default='png', choices=FRAME_FORMATS, help="image format of saved frames")
+    parser.add_argument("--png_compression", default=3, type=int, help="zlib level 0-9 of saved png frames")
+    parser.add_argument("--jpeg_quality", default=95, type=int, help="quality 1-100 of saved jpg frames")
+    parser.add_argument('-bs', "--batch_size", default=1, type=int, help="number of driving frames per forward pass")
 
     opt = parser.parse_args()
 
@@ -0,0 +1,171 @@
+"""
+Parallel export of rendered frames to image files.
+
+Frames are copied once into a shared-memory ring buffer, worker processes encode them
+to PNG/JPEG straight from the buffer, so no frame is pickled across processes.
+"""
+
+import os
+import time
+import queue
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+FRAME_FORMATS = ['png', 'jpg']
+
+
+def encode_params(frame_format, png_compression=3, jpeg_quality=95):
+    """
+    Keyword arguments for imageio's pillow writer.
+    """
+    if frame_format == 'png':
+        return {'compress_level': png_compression}
+    if frame_format == 'jpg':
+        return {'quality': jpeg_quality}
+    raise ValueError("Unknown frame format %s, expected one of %s" % (frame_format, FRAME_FORMATS))
+
+
+def export_worker(shm_name, num_slots, frame_shape, params, task_queue, done_queue):
+    import imageio.v2 as iio
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    ring = np.ndarray((num_slots,) + frame_shape, dtype=np.uint8, buffer=shm.buf)
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            slot, path = task
+            try:
+                iio.imwrite(path, ring[slot], **params)
+                done_queue.put((slot, os.path.getsize(path), None))
+            except Exception as e:
+                done_queue.put((slot, 0, "%s: %s" % (path, e)))
+    finally:
+        del ring
+        shm.close()
+
+
+class FrameExporter:
+    """
+    Write same-sized uint8 frames to image files with n_workers processes.
+    submit() blocks while all num_slots ring buffer slots wait for a worker, close() waits for every
+    frame to be written and returns the write throughput. Use it as a context manager.
+    """
+
+    def __init__(self, n_workers=8, num_slots=None, frame_format='png', png_compression=3, jpeg_quality=95):
+        self.n_workers = max(1, n_workers)
+        self.num_slots = num_slots if num_slots is not None else 4 * self.n_workers
+        self.params = encode_params(frame_format, png_compression, jpeg_quality)
+        self.frame_format = frame_format
+
+        self.shm = None
+        self.workers = []
+        self.free_slots = list(range(self.num_slots))
+        self.pending = 0
+        self.num_frames = 0
+        self.num_bytes = 0
+        self.errors = []
+        self.start_time = None
+
+    def start(self, frame_shape):
+        self.frame_shape = tuple(frame_shape)
+        self.shm = shared_memory.SharedMemory(create=True, size=self.num_slots * int(np.prod(self.frame_shape)))
+        self.ring = np.ndarray((self.num_slots,) + self.frame_shape, dtype=np.uint8, buffer=self.shm.buf)
+
+        self.task_queue = mp.Queue()
+        self.done_queue = mp.Queue()
+        for _ in range(self.n_workers):
+            worker = mp.Process(target=export_worker, daemon=True,
+                                args=(self.shm.name, self.num_slots, self.frame_shape, self.params,
+                                      self.task_queue, self.done_queue))
+            worker.start()
+            self.workers.append(worker)
+        self.start_time = time.perf_counter()
+
+    def collect(self):
+        while True:
+            try:
+                slot, num_bytes, error = self.done_queue.get(timeout=1)
+                break
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in self.workers):
+                    raise RuntimeError("Frame export workers exited with %d frames pending" % self.pending)
+        self.free_slots.append(slot)
+        self.pending -= 1
+        self.num_bytes += num_bytes
+        if error is not None:
+            self.errors.append(error)
+
+    def submit(self, frame, path):
+        """
+        Queue a H x W x 3 uint8 frame to be written to path, the frame is copied, so it can be reused.
+        """
+        if self.shm is None:
+            self.start(frame.shape)
+        if tuple(frame.shape) != self.frame_shape:
+            raise ValueError("Frame shape %s differs from %s" % (frame.shape, self.frame_shape))
+        while not self.free_slots:
+            self.collect()
+        slot = self.free_slots.pop()
+        self.ring[slot] = frame
+        self.task_queue.put((slot, path))
+        self.pending += 1
+        self.num_frames += 1
+
+    def close(self):
+        """
+        Wait for all frames, stop the workers and free the buffer, returns the write statistics.
+        """
+        if self.shm is not None:
+            while self.pending:
+                self.collect()
+            for _ in self.workers:
+                self.task_queue.put(None)
+            for worker in self.workers:
+                worker.join()
+            self.workers = []
+            del self.ring
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+        if self.errors:
+            raise IOError("Failed to write %d frames, first error: %s" % (len(self.errors), self.errors[0]))
+        seconds = time.perf_counter() - self.start_time if self.start_time is not None else 0
+        return {
+            'frames': self.num_frames,
+            'seconds': seconds,
+            'fps': self.num_frames / seconds if seconds else 0,
+            'MB/s': self.num_bytes / 2 ** 20 / seconds if seconds else 0,
+        }
+
+    def abort(self):
+        """
+        Stop the workers without waiting for the pending frames and free the buffer.
+        """
+        for worker in self.workers:
+            worker.terminate()
+            worker.join()
+        self.workers = []
+        if self.shm is not None:
+            del self.ring
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.stats = self.close()
+
+
+def frame_path(frame_dir, name, frame_format):
+    return os.path.join(frame_dir, "%s.%s" % (str(name).zfill(3), frame_format))
+
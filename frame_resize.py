@@ -0,0 +1,143 @@
+"""
+Batched resizing of uint8 frames for the I/O paths (demo, predict, dataset).
+
+Backends:
+  - 'parity': torch, reproduces skimage.transform.resize (gaussian anti-aliasing + bilinear)
+  - 'torch': torch F.interpolate with antialias, runs on the gpu when a device is given, needs torch >= 1.11
+  - 'cv2': cv2.resize with INTER_AREA, written straight into the output batch
+  - 'skimage': skimage.transform.resize frame by frame, the reference
+"""
+
+import inspect
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+RESIZE_BACKENDS = ['parity', 'torch', 'cv2', 'skimage']
+# F.interpolate(antialias=True) of the 'torch' backend, torch >= 1.11
+INTERPOLATE_ANTIALIAS = 'antialias' in inspect.signature(F.interpolate).parameters
+
+
+def gaussian_kernel1d(sigma):
+    """
+    Normalized gaussian kernel truncated like scipy.ndimage.gaussian_filter.
+    """
+    radius = int(4.0 * sigma + 0.5)
+    x = torch.arange(-radius, radius + 1, dtype=torch.float32)
+    kernel = torch.exp(-0.5 * (x / sigma) ** 2)
+    return kernel / kernel.sum()
+
+
+def mirror_pad(frames, radius, dim):
+    """
+    Pad dim of frames by radius on both sides like the 'mirror' mode of scipy.ndimage, which
+    skimage.transform.resize uses: reflected about the edge pixels, repeatedly for a radius beyond the size.
+    """
+    while radius > 0:
+        size = frames.shape[dim]
+        if size == 1:
+            return torch.cat([frames] * (2 * radius + 1), dim)
+        pad = min(radius, size - 1)
+        frames = torch.cat([frames.narrow(dim, 1, pad).flip(dim), frames,
+                            frames.narrow(dim, size - 1 - pad, pad).flip(dim)], dim)
+        radius -= pad
+    return frames
+
+
+def gaussian_blur(frames, sigmas):
+    """
+    Separable gaussian blur of N x C x H x W frames with mirror borders, one sigma per spatial axis.
+    """
+    channels = frames.shape[1]
+    for axis, sigma in enumerate(sigmas):
+        if sigma <= 0:
+            continue
+        kernel = gaussian_kernel1d(sigma).to(frames.device)
+        radius = kernel.shape[0] // 2
+        kernel = kernel.view(1, 1, -1, 1) if axis == 0 else kernel.view(1, 1, 1, -1)
+        frames = mirror_pad(frames, radius, 2 + axis)
+        frames = F.conv2d(frames, kernel.repeat(channels, 1, 1, 1), groups=channels)
+    return frames
+
+
+def bilinear_resize(frames, img_shape):
+    """
+    Bilinear resize of N x C x H x W frames sampled at pixel centers like skimage, neighbours outside
+    the frame are mirrored where F.interpolate would repeat the edge pixels.
+    """
+    frames = mirror_pad(mirror_pad(frames, 1, 2), 1, 3)
+    coordinates = []
+    for axis in range(2):
+        size = frames.shape[2 + axis] - 2
+        coordinate = (torch.arange(img_shape[axis], dtype=torch.float64) + 0.5) * size / img_shape[axis] + 0.5
+        # pixel centers of the padded frames span [-1, 1]
+        coordinates.append((coordinate * 2 / (size + 1) - 1).float().to(frames.device))
+    grid = torch.stack([coordinates[1].view(1, -1).expand(img_shape[0], -1),
+                        coordinates[0].view(-1, 1).expand(-1, img_shape[1])], dim=-1)
+    return F.grid_sample(frames, grid.expand(frames.shape[0], -1, -1, -1), mode='bilinear',
+                         padding_mode='border', align_corners=True)
+
+
+def resize_torch(frames, img_shape, parity, device):
+    frames = torch.from_numpy(frames).to(device).permute(0, 3, 1, 2).float()
+    if parity:
+        sigmas = [max(0, (frames.shape[2 + axis] / img_shape[axis] - 1) / 2) for axis in range(2)]
+        frames = bilinear_resize(gaussian_blur(frames, sigmas), img_shape)
+    else:
+        frames = F.interpolate(frames, size=tuple(img_shape), mode='bilinear', align_corners=False, antialias=True)
+    frames = frames.round_().clamp_(0, 255).to(torch.uint8)
+    return frames.permute(0, 2, 3, 1).cpu().numpy()
+
+
+def resize_cv2(frames, img_shape):
+    import cv2
+
+    # INTER_AREA as soon as either side shrinks, INTER_LINEAR aliases when downsampling
+    shrinks = img_shape[0] < frames.shape[1] or img_shape[1] < frames.shape[2]
+    interpolation = cv2.INTER_AREA if shrinks else cv2.INTER_LINEAR
+    out = np.empty((len(frames),) + tuple(img_shape) + (3,), dtype=np.uint8)
+    for i, frame in enumerate(frames):
+        # cv2 releases the GIL and writes straight into the output buffer
+        cv2.resize(np.ascontiguousarray(frame), (img_shape[1], img_shape[0]), dst=out[i], interpolation=interpolation)
+    return out
+
+
+def resize_skimage(frames, img_shape):
+    from skimage.transform import resize
+    from skimage import img_as_ubyte
+
+    return np.array([img_as_ubyte(resize(frame, img_shape)) for frame in frames])
+
+
+def resize_frames(frames, img_shape, backend='parity', device=None, batch_size=64):
+    """
+    Resize N x H x W x C uint8 frames (array or list of same-sized frames) to img_shape (h, w).
+    Returns a N x h x w x 3 uint8 array, alpha channels are dropped and gray frames become rgb.
+    Frames are stacked and resized batch_size at a time, so a decoded list is never copied as a whole.
+    """
+    if backend not in RESIZE_BACKENDS:
+        raise ValueError("Unknown resize backend %s, expected one of %s" % (backend, RESIZE_BACKENDS))
+    if backend == 'torch' and not INTERPOLATE_ANTIALIAS:
+        raise ValueError("The torch resize backend needs torch >= 1.11, found %s, use parity instead"
+                         % torch.__version__)
+    img_shape = tuple(img_shape[:2])
+    device = torch.device('cpu') if device is None else device
+
+    out = np.empty((len(frames),) + img_shape + (3,), dtype=np.uint8)
+    for start in range(0, len(frames), batch_size):
+        batch = np.asarray(frames[start:(start + batch_size)])
+        if batch.ndim == 3:
+            batch = np.repeat(batch[..., np.newaxis], 3, axis=-1)
+        batch = batch[..., :3]
+
+        if batch.shape[1:3] == img_shape:
+            resized = batch
+        elif backend == 'skimage':
+            resized = resize_skimage(batch, img_shape)
+        elif backend == 'cv2':
+            resized = resize_cv2(batch, img_shape)
+        else:
+            resized = resize_torch(np.ascontiguousarray(batch), img_shape, parity=(backend == 'parity'), device=device)
+        out[start:(start + len(batch))] = resized
+    return out
@@ -1,14 +1,30 @@
 import os
+import re
 from skimage import io, img_as_float32
 from skimage.color import gray2rgb
 from sklearn.model_selection import train_test_split
-from imageio import mimread
+from imageio import mimread, get_reader
 from skimage.transform import resize
 import numpy as np
-from torch.utils.data import Dataset
-from augmentation import AllAugmentationTransform
-import glob
+import time
+import tempfile
+import contextlib
+import warnings
+import torch
+import torch.distributed as dist
+from torch.utils.data import Dataset, Sampler, DataLoader, DistributedSampler
+from torch.utils.data.dataloader import default_collate
+from collections import OrderedDict
+from augmentation import AllAugmentationTransform, TensorAugmentationTransform
+from frame_resize import resize_frames
+import json
 from functools import partial
+from multiprocessing import Pool
+
+# index written by convert_dataset.py next to the uint8 frame shards
+SHARD_INDEX = 'shards.json'
+# bump when the layout of the dataset index changes, older index files are rebuilt
+DATASET_INDEX_VERSION = 2
 
 
 def read_video(name, frame_shape):
@@ -44,7 +60,7 @@ def read_video(name, frame_shape):
         if len(video[0].shape) == 2:
             video = [gray2rgb(frame) for frame in video]
         if frame_shape is not None:
-            video = np.array([resize(frame, frame_shape) for frame in video])
+            video = resize_frames(video, frame_shape[:2])
         video = np.array(video)
         if video.shape[-1] == 4:
             video = video[..., :3]
@@ -55,106 +71,558 @@ def read_video(name, frame_shape):
     return video_array
 
 
+def video_frame_count(name):
+    """
+    Number of frames of a '.mp4', '.mov' or '.gif' file, without decoding it into memory.
+    """
+    reader = get_reader(name)
+    try:
+        if name.lower().endswith('.gif'):
+            return reader.get_length()
+        return reader.count_frames()
+    finally:
+        reader.close()
+
+
+def decode_frames(name, frame_idx, frame_shape):
+    """
+    Decode only the frames frame_idx (sorted) of a '.mp4', '.mov' or '.gif' file, the reader seeks to
+    the closest keyframe instead of decoding the whole video. Returns uint8 rgb frames of frame_shape.
+    """
+    reader = get_reader(name)
+    try:
+        frames = [reader.get_data(idx) for idx in frame_idx]
+    finally:
+        reader.close()
+    # resize_frames also drops alpha and turns gray frames into rgb
+    return resize_frames(frames, frame_shape[:2] if frame_shape is not None else frames[0].shape[:2])
+
+
+def read_frames(name, frame_idx, frame_shape):
+    """
+    decode_frames returned like read_video.
+    """
+    return img_as_float32(decode_frames(name, frame_idx, frame_shape))
+
+
+def frame_file_format(names):
+    """
+    printf format and first number of consecutively numbered frame files, e.g. ('frame%05d.png', 0),
+    None if the names don't follow one.
+    """
+    matches = [re.match(r'(.*?)(\d+)(\.\w+)$', name) for name in names]
+    if not matches or not all(matches) or len({(m.group(1), m.group(3)) for m in matches}) != 1:
+        return None
+    widths = {len(m.group(2)) for m in matches}
+    number_format = '%%0%dd' % widths.pop() if len(widths) == 1 else '%d'
+    frame_format = matches[0].group(1).replace('%', '%%') + number_format + matches[0].group(3).replace('%', '%%')
+    first = min(int(m.group(2)) for m in matches)
+    if sorted(names) != sorted(frame_format % (first + i) for i in range(len(names))):
+        return None
+    return frame_format, first
+
+
+def index_entry(path):
+    """
+    Name and frame count of a video, None for an image of concatenated frames. Folders of frames also
+    keep their file names, as a numbered format when they follow one, so items never list them.
+    """
+    name = os.path.basename(path)
+    num_frames = None
+    if os.path.isdir(path):
+        frames = sorted(os.listdir(path))
+        num_frames = len(frames)
+        file_format = frame_file_format(frames)
+        if file_format is not None:
+            return {'name': name, 'num_frames': num_frames, 'frame_format': file_format[0],
+                    'first_frame': file_format[1]}
+        return {'name': name, 'num_frames': num_frames, 'frame_names': frames}
+    elif name.lower().endswith(('.mp4', '.gif', '.mov')):
+        num_frames = video_frame_count(path)
+    return {'name': name, 'num_frames': num_frames}
+
+
+def load_dataset_index(root_dir, index_path=None, n_workers=8):
+    """
+    Videos of a dataset root and their frame counts, per split ('train' and 'test' for a predefined split,
+    'all' otherwise), in os.listdir order. The index is cached in index_path (<root_dir>_index.json by
+    default, outside the root so writing it doesn't touch the root's mtime) and rebuilt with n_workers
+    processes when its version or the modification time of a split directory changed.
+    """
+    root_dir = os.path.normpath(root_dir)
+    index_path = index_path if index_path is not None else root_dir + '_index.json'
+    if os.path.exists(os.path.join(root_dir, 'train')):
+        assert os.path.exists(os.path.join(root_dir, 'test'))
+        split_dirs = {split: os.path.join(root_dir, split) for split in ['train', 'test']}
+    else:
+        split_dirs = {'all': root_dir}
+    mtimes = {split: os.path.getmtime(split_dir) for split, split_dir in split_dirs.items()}
+
+    # in distributed training rank 0 builds and writes the index, the other ranks read it once it is written
+    distributed = dist.is_available() and dist.is_initialized()
+    if distributed and dist.get_rank() != 0:
+        dist.barrier()
+        index = cached_index(index_path, mtimes)
+    else:
+        try:
+            index = cached_index(index_path, mtimes)
+            if index is None:
+                index = build_index(split_dirs, mtimes, n_workers)
+                try:
+                    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(index_path) or '.', suffix='.tmp')
+                    try:
+                        with os.fdopen(fd, 'w') as f:
+                            json.dump(index, f)
+                        os.replace(tmp_path, index_path)
+                    finally:
+                        if os.path.exists(tmp_path):
+                            os.remove(tmp_path)
+                except OSError as e:
+                    warnings.warn("Dataset index not cached: %s" % e)
+        finally:
+            # also when building the index failed, so the other ranks don't wait for it until the timeout
+            if distributed:
+                dist.barrier()
+    if index is None:
+        raise RuntimeError("Dataset index %s was not written by rank 0, see its error. Set index_path to a "
+                           "writable location if the parent of root_dir is not writable." % index_path)
+    return index
+
+
+def cached_index(index_path, mtimes):
+    """
+    The dataset index stored in index_path, None if it is missing, unreadable, e.g. truncated, or out of date.
+    """
+    if not os.path.exists(index_path):
+        return None
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if isinstance(index, dict) and index.get('version') == DATASET_INDEX_VERSION and index.get('mtimes') == mtimes:
+        return index
+    return None
+
+
+def build_index(split_dirs, mtimes, n_workers):
+    index = {'version': DATASET_INDEX_VERSION, 'mtimes': mtimes, 'splits': {}}
+    with Pool(n_workers) as pool:
+        for split, split_dir in split_dirs.items():
+            paths = [os.path.join(split_dir, name) for name in os.listdir(split_dir)]
+            index['splits'][split] = pool.map(index_entry, paths, chunksize=16)
+    return index
+
+
 class FramesDataset(Dataset):
     """
     Dataset of videos, each video can be represented as:
       - an image of concatenated frames
       - '.mp4' or '.gif'
       - folder with all frames
+    With random_access, training items decode only the two sampled frames of video files,
+    their frame counts are cached per video.
+    A root_dir written by convert_dataset.py is read from its memory-mapped uint8 shards, nothing is decoded.
+    Other roots are listed through a cached index of videos and frame counts, see load_dataset_index.
+    With pairs_per_video > 1 a training item holds that many independent (source, driving) pairs of the
+    same video, stacked along a first dimension, see collate_pairs. clip_cache_size keeps that many
+    decoded video files per worker, least recently used first out.
+    augmentation_backend 'numpy' augments frame by frame with augmentation.AllAugmentationTransform,
+    'tensor' with augmentation.TensorAugmentationTransform in the dataloader workers and 'batch' leaves
+    the augmentation to the training loop, through batch_transform, on whole batches on the device.
+    With uint8_samples training items hold uint8 frames, a quarter of the float32 size to move between
+    processes, BatchPrefetcher turns them into floats on the device.
     """
 
     def __init__(self, root_dir, frame_shape=(256, 256, 3), id_sampling=False, is_train=True,
-                 random_seed=0, pairs_list=None, augmentation_params=None):
+                 random_seed=0, pairs_list=None, augmentation_params=None, random_access=True, index_path=None,
+                 pairs_per_video=1, clip_cache_size=0, augmentation_backend='numpy', uint8_samples=False):
         self.root_dir = root_dir
-        self.videos = os.listdir(root_dir)
+        self.uint8_samples = uint8_samples
+        self.augmentation_backend = augmentation_backend
+        self.random_access = random_access
+        self.pairs_per_video = pairs_per_video if is_train else 1
+        self.clip_cache_size = clip_cache_size
+        self.clip_cache = OrderedDict()
+        self.frame_counts = {}
+        self.shard_index = None
+        if os.path.exists(os.path.join(root_dir, SHARD_INDEX)):
+            self.init_shards(root_dir, frame_shape, id_sampling, is_train, random_seed, augmentation_params)
+            return
+        index = load_dataset_index(root_dir, index_path=index_path)
         self.frame_shape = frame_shape
-        print(self.frame_shape)
         self.pairs_list = pairs_list
         self.id_sampling = id_sampling
 
-        if os.path.exists(os.path.join(root_dir, 'train')):
-            assert os.path.exists(os.path.join(root_dir, 'test'))
+        if 'train' in index['splits']:
             print("Use predefined train-test split.")
-            if id_sampling:
-                train_videos = {os.path.basename(video).split('#')[0] for video in
-                                os.listdir(os.path.join(root_dir, 'train'))}
-                train_videos = list(train_videos)
-            else:
-                train_videos = os.listdir(os.path.join(root_dir, 'train'))
-            test_videos = os.listdir(os.path.join(root_dir, 'test'))
+            train_videos, test_videos = index['splits']['train'], index['splits']['test']
             self.root_dir = os.path.join(self.root_dir, 'train' if is_train else 'test')
         else:
             print("Use random train-test split.")
-            train_videos, test_videos = train_test_split(self.videos, random_state=random_seed, test_size=0.2)
+            train_videos, test_videos = train_test_split(index['splits']['all'], random_state=random_seed,
+                                                         test_size=0.2)
 
-        if is_train:
-            self.videos = train_videos
-        else:
-            self.videos = test_videos
+        entries = train_videos if is_train else test_videos
+        self.frame_counts = {os.path.join(self.root_dir, entry['name']): entry['num_frames'] for entry in entries
+                             if entry['num_frames'] is not None}
+        # folders of frames, their file names are read from the index
+        self.frame_dirs = {os.path.join(self.root_dir, entry['name']): entry for entry in entries
+                           if 'frame_format' in entry or 'frame_names' in entry}
+        self.videos = [entry['name'] for entry in entries]
+        if id_sampling:
+            # identity -> its '.mp4' videos, identities are the part of the names before '#'
+            self.id_videos = {}
+            for name in self.videos:
+                if name.endswith('.mp4'):
+                    self.id_videos.setdefault(name.split('#')[0], []).append(name)
+            if is_train:
+                self.videos = list(self.id_videos)
 
         self.is_train = is_train
+        self.init_transform(augmentation_params)
 
-        if self.is_train:
+    def init_transform(self, augmentation_params):
+        self.transform, self.batch_transform = None, None
+        if not self.is_train:
+            return
+        if self.augmentation_backend == 'numpy':
             self.transform = AllAugmentationTransform(**augmentation_params)
+        elif self.augmentation_backend == 'tensor':
+            self.transform = TensorAugmentationTransform(**augmentation_params)
+        elif self.augmentation_backend == 'batch':
+            self.batch_transform = TensorAugmentationTransform(**augmentation_params)
         else:
-            self.transform = None
+            raise ValueError("Unknown augmentation backend %s, expected numpy, tensor or batch"
+                             % self.augmentation_backend)
+
+    def init_shards(self, root_dir, frame_shape, id_sampling, is_train, random_seed, augmentation_params):
+        with open(os.path.join(root_dir, SHARD_INDEX)) as f:
+            self.shard_index = json.load(f)
+        if frame_shape is not None and tuple(frame_shape[:2]) != tuple(self.shard_index['frame_shape'][:2]):
+            raise ValueError("Shards in %s hold %s frames, not %s" % (root_dir, self.shard_index['frame_shape'],
+                                                                       frame_shape))
+        self.root_dir = root_dir
+        self.frame_shape = tuple(self.shard_index['frame_shape'])
+        self.pairs_list = None
+        self.id_sampling = id_sampling
+        self.is_train = is_train
+        self.init_transform(augmentation_params)
+
+        splits = self.shard_index['splits']
+        if 'train' in splits:
+            entries = splits['train' if is_train else 'test']
+        else:
+            train_entries, test_entries = train_test_split(splits['all'], random_state=random_seed, test_size=0.2)
+            entries = train_entries if is_train else test_entries
+        self.shard_entries = {entry['name']: entry for entry in entries}
+        if is_train and id_sampling:
+            self.id_videos = {}
+            for name in sorted(self.shard_entries):
+                self.id_videos.setdefault(name.split('#')[0], []).append(name)
+            self.videos = list(self.id_videos)
+        else:
+            self.videos = [entry['name'] for entry in entries]
+        # opened lazily, so every dataloader worker maps the shards itself
+        self.shards = [None] * len(self.shard_index['shards'])
+
+    def shard_frames(self, entry, frame_idx):
+        """
+        uint8 frames of a video read from its memory-mapped shard.
+        """
+        if self.shards[entry['shard']] is None:
+            path = os.path.join(self.root_dir, self.shard_index['shards'][entry['shard']])
+            self.shards[entry['shard']] = np.load(path, mmap_mode='r')
+        video = self.shards[entry['shard']][entry['start']:(entry['start'] + entry['num_frames'])]
+        return video[frame_idx]
 
     def __len__(self):
         return len(self.videos)
 
     def __getitem__(self, idx):
+        if self.shard_index is not None:
+            return self.get_shard_item(idx)
             
         if self.is_train and self.id_sampling:   
             name = self.videos[idx]
-            path = np.random.choice(glob.glob(os.path.join(self.root_dir, name + '*.mp4')))
+            path = os.path.join(self.root_dir, np.random.choice(self.id_videos[name]))
         else:
             name = self.videos[idx]
             path = os.path.join(self.root_dir, name)
 
         video_name = os.path.basename(path)
-        if self.is_train and os.path.isdir(path):
+        if self.is_train and path in self.frame_dirs:
+            entry = self.frame_dirs[path]
+            frame_idx = self.sample_frame_idx(entry['num_frames'])
+            if 'frame_format' in entry:
+                frames = [entry['frame_format'] % (entry['first_frame'] + idx) for idx in frame_idx]
+            else:
+                frames = [entry['frame_names'][idx] for idx in frame_idx]
 
-            frames = os.listdir(path)
-            num_frames = len(frames)
-            frame_idx = np.sort(np.random.choice(num_frames, replace=True, size=2))
-            
             if self.frame_shape is not None:
                 resize_fn = partial(resize, output_shape=self.frame_shape)
             else:
                 resize_fn = img_as_float32
 
-            if type(frames[0]) is bytes:
-                video_array = [resize_fn(io.imread(os.path.join(path, frames[idx].decode('utf-8')))) for idx in
-                            frame_idx]
+            video_array = [resize_fn(io.imread(os.path.join(path, frame))) for frame in frames]
+        elif self.is_train and self.random_access and path.lower().endswith(('.mp4', '.gif', '.mov')):
+            if path not in self.frame_counts:
+                self.frame_counts[path] = video_frame_count(path)
+            num_frames = self.frame_counts[path]
+            frame_idx = self.sample_frame_idx(num_frames)
+            if self.clip_cache_size > 0:
+                video_array = img_as_float32(self.cached_clip(path, num_frames)[frame_idx])
             else:
-                video_array = [resize_fn(io.imread(os.path.join(path, frames[idx]))) for idx in frame_idx]
+                # every sampled frame is decoded once, in order
+                unique_idx, inverse = np.unique(frame_idx, return_inverse=True)
+                video_array = read_frames(path, unique_idx, self.frame_shape)[inverse]
         else:
                  
             video_array = read_video(path, frame_shape=self.frame_shape)
             
             num_frames = len(video_array)
-            frame_idx = np.sort(np.random.choice(num_frames, replace=True, size=2)) if self.is_train else range(
-                num_frames)
+            frame_idx = self.sample_frame_idx(num_frames) if self.is_train else range(num_frames)
             video_array = video_array[frame_idx]
             
 
+        return self.make_item(video_array, video_name)
+
+    def sample_frame_idx(self, num_frames):
+        """
+        Frame indices of pairs_per_video (source, driving) pairs, flattened, each pair in temporal order.
+        """
+        frame_idx = np.random.choice(num_frames, replace=True, size=(self.pairs_per_video, 2))
+        return np.sort(frame_idx, axis=1).reshape(-1)
+
+    def cached_clip(self, path, num_frames):
+        """
+        Every uint8 frame of a video file, decoded once and kept in the per-worker LRU cache.
+        """
+        if path in self.clip_cache:
+            self.clip_cache.move_to_end(path)
+        else:
+            self.clip_cache[path] = decode_frames(path, range(num_frames), self.frame_shape)
+            if len(self.clip_cache) > self.clip_cache_size:
+                self.clip_cache.popitem(last=False)
+        return self.clip_cache[path]
+
+    def make_item(self, video_array, video_name):
+        if self.is_train and self.pairs_per_video > 1:
+            # every pair gets its own augmentation
+            pairs = [self.make_item_pair(video_array[(2 * i):(2 * i + 2)]) for i in range(self.pairs_per_video)]
+            return {
+                'driving': np.stack([pair['driving'] for pair in pairs]),
+                'source': np.stack([pair['source'] for pair in pairs]),
+                'name': video_name,
+            }
+        out = self.make_item_pair(video_array)
+        out['name'] = video_name
+        return out
+
+    def make_item_pair(self, video_array):
         if self.transform is not None:
             video_array = self.transform(video_array)
 
         out = {}
         if self.is_train:
-            source = np.array(video_array[0], dtype='float32')
-            driving = np.array(video_array[1], dtype='float32')
+            if self.uint8_samples:
+                source, driving = to_uint8(video_array[0]), to_uint8(video_array[1])
+            else:
+                source = img_as_float32(np.asarray(video_array[0]))
+                driving = img_as_float32(np.asarray(video_array[1]))
 
             out['driving'] = driving.transpose((2, 0, 1))
             out['source'] = source.transpose((2, 0, 1))
         else:
-            video = np.array(video_array, dtype='float32')
+            video = img_as_float32(np.asarray(video_array))
             out['video'] = video.transpose((3, 0, 1, 2))
-
-        out['name'] = video_name
         return out
 
+    def get_shard_item(self, idx):
+        name = self.videos[idx]
+        if self.is_train and self.id_sampling:
+            name = np.random.choice(self.id_videos[name])
+        entry = self.shard_entries[name]
+        num_frames = entry['num_frames']
+        frame_idx = self.sample_frame_idx(num_frames) if self.is_train else slice(None)
+        video_array = self.shard_frames(entry, frame_idx)
+        if isinstance(self.transform, AllAugmentationTransform):
+            # the numpy augmentation works on floats, the other paths take the uint8 frames as they are
+            video_array = img_as_float32(video_array)
+        return self.make_item(video_array, name)
+
+
+def to_uint8(frame):
+    frame = np.asarray(frame)
+    if frame.dtype == np.uint8:
+        return frame
+    return (np.clip(frame, 0, 1) * 255 + 0.5).astype(np.uint8)
+
+
+def collate_pairs(batch):
+    """
+    Collate items of a FramesDataset with pairs_per_video > 1 into a flat batch of pairs.
+    """
+    batch = default_collate(batch)
+    pairs_per_video = batch['source'].shape[1]
+    batch['source'] = batch['source'].flatten(0, 1)
+    batch['driving'] = batch['driving'].flatten(0, 1)
+    batch['name'] = [name for name in batch['name'] for _ in range(pairs_per_video)]
+    return batch
+
+
+class DiverseBatchSampler(Sampler):
+    """
+    Shuffled batches over a DatasetRepeater of num_videos items (identities with id_sampling)
+    in which no item appears twice. With num_replicas > 1 every distributed process gets every
+    num_replicas-th batch from rank, the order is shared through seed and set_epoch.
+    """
+
+    def __init__(self, num_items, num_videos, batch_size, drop_last=True, num_replicas=1, rank=0, seed=0):
+        self.num_items = num_items
+        self.num_videos = num_videos
+        self.batch_size = min(batch_size, num_videos)
+        self.drop_last = drop_last
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        if self.drop_last:
+            return self.num_items // self.batch_size // self.num_replicas
+        return (self.num_items + self.batch_size - 1) // self.batch_size // self.num_replicas
+
+    def __iter__(self):
+        if self.num_replicas == 1:
+            return self.batches(np.random)
+        batches = list(self.batches(np.random.RandomState(self.seed + self.epoch)))
+        # the same number of batches for every process
+        num_batches = len(batches) // self.num_replicas * self.num_replicas
+        return iter(batches[self.rank:num_batches:self.num_replicas])
+
+    def batches(self, random_state):
+        num_repeats = (self.num_items + self.num_videos - 1) // self.num_videos
+        order = np.concatenate([random_state.permutation(self.num_videos) + i * self.num_videos
+                                for i in range(num_repeats)])
+        order = order[order < self.num_items]
+
+        batch, videos, deferred = [], set(), []
+        for idx in order:
+            # a video already in the batch is deferred to the next one, which only happens across two repeats
+            candidates, deferred = deferred + [idx], []
+            for candidate in candidates:
+                if candidate % self.num_videos in videos or len(batch) == self.batch_size:
+                    deferred.append(candidate)
+                else:
+                    batch.append(candidate)
+                    videos.add(candidate % self.num_videos)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch, videos = [], set()
+        if not self.drop_last and batch + deferred:
+            yield batch + deferred
+
+
+def training_dataloader(dataset, num_videos, pairs_per_video, train_params):
+    """
+    The training DataLoader over dataset, a FramesDataset of num_videos items, possibly repeated.
+    Workers persist across epochs, prefetch_factor in train_params sets how many batches each keeps ready.
+    On a gpu the batches are pinned by the DataLoader, off the training loop, for BatchPrefetcher's copies.
+    In a distributed run batch_size is the global batch, every process loads its share of it from its
+    own part of the dataset, call set_epoch on the sampler (BatchPrefetcher.set_epoch) every epoch.
+    """
+    num_workers = train_params['dataloader_workers']
+    num_replicas, rank = 1, 0
+    if dist.is_available() and dist.is_initialized():
+        num_replicas, rank = dist.get_world_size(), dist.get_rank()
+    batch_size = train_params['batch_size'] // num_replicas
+    if batch_size < 1:
+        raise ValueError("batch_size %d is smaller than the %d processes" % (train_params['batch_size'], num_replicas))
+    if train_params['batch_size'] % num_replicas != 0:
+        raise ValueError("batch_size %d is not a multiple of the %d processes" % (train_params['batch_size'],
+                                                                                  num_replicas))
+    kwargs = {'pin_memory': torch.cuda.is_available()}
+    if num_workers > 0:
+        kwargs.update(persistent_workers=True, prefetch_factor=train_params.get('prefetch_factor', 2))
+    if pairs_per_video > 1:
+        # batch_size counts pairs, the videos of a batch are distinct and each gives pairs_per_video of them
+        if batch_size % pairs_per_video != 0:
+            raise ValueError("batch_size %d is not a multiple of pairs_per_video %d" % (batch_size, pairs_per_video))
+        if batch_size // pairs_per_video > num_videos:
+            raise ValueError("batch_size %d needs %d distinct videos with pairs_per_video %d, the dataset has %d"
+                             % (batch_size, batch_size // pairs_per_video, pairs_per_video, num_videos))
+        # an epoch keeps its number of pairs, from pairs_per_video times fewer videos
+        batch_sampler = DiverseBatchSampler(len(dataset) // pairs_per_video, num_videos, batch_size // pairs_per_video,
+                                            num_replicas=num_replicas, rank=rank)
+        return DataLoader(dataset, batch_sampler=batch_sampler, num_workers=num_workers, collate_fn=collate_pairs,
+                          **kwargs)
+    if num_replicas > 1:
+        sampler = DistributedSampler(dataset, num_replicas=num_replicas, rank=rank, shuffle=True, drop_last=True)
+        return DataLoader(dataset, batch_size=batch_size, sampler=sampler, num_workers=num_workers,
+                          drop_last=True, **kwargs)
+    return DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers,
+                      drop_last=True, **kwargs)
+
+
+class BatchPrefetcher:
+    """
+    Iterate over the batches of a DataLoader with the keys tensors on device as floats in [0, 1].
+    On a gpu the next batch is sent on a side stream while the current one is used, the copies are
+    asynchronous for batches pinned by the DataLoader (pin_memory=True), uint8 tensors are converted
+    on the device. data_wait is the time the last batch was waited for, the dataloader falling behind
+    shows as a data_wait close to the step time.
+    """
+
+    def __init__(self, loader, keys=('source', 'driving'), device=None):
+        self.loader = loader
+        self.keys = keys
+        self.device = torch.device(device if device is not None else 'cuda' if torch.cuda.is_available() else 'cpu')
+        self.stream = torch.cuda.Stream(self.device) if self.device.type == 'cuda' else None
+        self.data_wait = 0
+
+    def __len__(self):
+        return len(self.loader)
+
+    def set_epoch(self, epoch):
+        sampler = self.loader.batch_sampler if hasattr(self.loader.batch_sampler, 'set_epoch') else self.loader.sampler
+        if hasattr(sampler, 'set_epoch'):
+            sampler.set_epoch(epoch)
+
+    def __iter__(self):
+        batches = iter(self.loader)
+        next_batch, next_wait = self.preload(batches)
+        while next_batch is not None:
+            if self.stream is not None:
+                torch.cuda.current_stream(self.device).wait_stream(self.stream)
+                for key in self.keys:
+                    next_batch[key].record_stream(torch.cuda.current_stream(self.device))
+            batch, self.data_wait = next_batch, next_wait
+            next_batch, next_wait = self.preload(batches)
+            yield batch
+
+    def preload(self, batches):
+        start = time.perf_counter()
+        try:
+            batch = next(batches)
+        except StopIteration:
+            return None, 0
+        data_wait = time.perf_counter() - start
+        # the caching host allocator keeps a pinned batch alive until its copy on the side stream is done
+        with torch.cuda.stream(self.stream) if self.stream is not None else contextlib.nullcontext():
+            for key in self.keys:
+                batch[key] = to_float(batch[key].to(self.device, non_blocking=True))
+        return batch, data_wait
+
+
+def to_float(tensor):
+    if tensor.dtype == torch.uint8:
+        return tensor.float().div_(255)
+    return tensor.float()
+
 
 class DatasetRepeater(Dataset):
     """
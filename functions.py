@@ -1,5 +1,4 @@
 import os
-import cv2
 import numpy as np
 
 import imageio.v2 as iio
@@ -18,18 +17,59 @@ def crop_face(image: np.ndarray, center, off_x=128, off_y=128, size=256):
     return image[top_left[1]: top_left[1]+size, top_left[0]: top_left[0]+size, :], top_left
 
 
-def replace(image: np.ndarray, repl_img: np.ndarray, top_left_point: tuple, size=256):
+def feather_mask(h, w, feather):
     """
+    h x w x 1 blend mask, 1 inside and falling linearly to 0 over `feather` pixels towards the borders.
+    """
+    ramp_y = np.minimum(np.arange(h), np.arange(h)[::-1]) + 1
+    ramp_x = np.minimum(np.arange(w), np.arange(w)[::-1]) + 1
+    mask = np.minimum(ramp_y[:, None], ramp_x[None, :]) / (feather + 1)
+    return np.clip(mask, 0, 1).astype(np.float32)[..., None]
+
 
-    :param image: original image
-    :param repl_img:
-    :param top_left_point:
-    :param size:
-    :return:
+class CropCompositor:
     """
-    new_image = image.copy() # deep copy
-    new_image[top_left_point[1]: top_left_point[1]+size, top_left_point[0]: top_left_point[0]+size, :3] = repl_img
-    return new_image
+    Paste rendered crops back into the full resolution image.
+    A single canvas is allocated and reused, each composite is only valid until the next one is produced.
+    """
+
+    def __init__(self, image: np.ndarray, top_left_point: tuple, crop_shape: tuple, feather=0):
+        """
+
+        :param image: original image
+        :param top_left_point: (x, y) of the crop in image
+        :param crop_shape: (h, w) of the crop in image
+        :param feather: width in pixels of the blend at the crop borders, 0 pastes the crop as is
+        """
+        self.canvas = np.array(image[..., :3], dtype=np.uint8)
+        x, y = top_left_point
+        self.crop_shape = tuple(crop_shape[:2])
+        self.region = (slice(y, y + self.crop_shape[0]), slice(x, x + self.crop_shape[1]))
+        self.mask = None
+        if feather > 0:
+            self.mask = feather_mask(*self.crop_shape, feather)
+            self.background = self.canvas[self.region].astype(np.float32) * (1 - self.mask)
+
+    def blend(self, crops):
+        """
+        Blend a N x h x w x 3 batch of crops with the background in one vectorized operation.
+        """
+        if self.mask is None:
+            return crops
+        blended = crops * self.mask + self.background
+        return np.rint(blended, out=blended).astype(np.uint8)
+
+    def composite(self, crops):
+        """
+        Yield the canvas with each crop of the batch pasted in, crops are resized to crop_shape if needed.
+        """
+        crops = np.asarray(crops)
+        if crops.shape[1:3] != self.crop_shape:
+            from frame_resize import resize_frames
+            crops = resize_frames(crops, self.crop_shape)
+        for crop in self.blend(crops):
+            self.canvas[self.region] = crop
+            yield self.canvas
 
 
 def frames_to_video(img_dir: str, output='output.mp4', img_format='png', video_format='mp4', fps=30):
@@ -48,6 +88,8 @@ def frames_to_video(img_dir: str, output='output.mp4', img_format='png', video_f
 
 
 def get_fa_kps(img, fa):
+    import cv2
+
     img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     kps = fa.get_landmarks(img)
     if kps is None:
@@ -57,10 +99,3 @@ def get_fa_kps(img, fa):
 
 def save_image(image, path):
     iio.imsave(path, image)
-
-
-def save_images(images, path_list: list):
-    # chunksize = round(len(path_list) / n_workers)
-    assert len(images)==len(path_list), "images and paths length not matched!"
-    for image, path in zip(images, path_list):
-        iio.imsave(path, image)
@@ -10,21 +10,40 @@ import matplotlib.pyplot as plt
 import collections
 
 
+def to_float32(value):
+    """
+    The tensors of nested dicts and lists as float32, mixed precision outputs are half precision.
+    """
+    if isinstance(value, dict):
+        return {key: to_float32(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(to_float32(item) for item in value)
+    if torch.is_tensor(value) and value.is_floating_point():
+        return value.float()
+    return value
+
+
 class Logger:
-    def __init__(self, log_dir, checkpoint_freq=50, visualizer_params=None, zfill_num=8, log_file_name='log.txt'):
+    def __init__(self, log_dir, checkpoint_freq=50, visualizer_params=None, zfill_num=8, log_file_name='log.txt',
+                 write=True):
 
+        # write=False, for all distributed processes but the first, logs and saves nothing
+        self.write = write
         self.loss_list = []
+        # seconds per iteration, e.g. the data_wait of BatchPrefetcher, logged on a line of their own
+        self.timing_list = []
         self.cpk_dir = log_dir
         self.visualizations_dir = os.path.join(log_dir, 'train-vis')
-        if not os.path.exists(self.visualizations_dir):
+        if write and not os.path.exists(self.visualizations_dir):
             os.makedirs(self.visualizations_dir)
-        self.log_file = open(os.path.join(log_dir, log_file_name), 'a')
+        self.log_file = open(os.path.join(log_dir, log_file_name), 'a') if write else None
         self.zfill_num = zfill_num
         self.visualizer = Visualizer(**visualizer_params)
         self.checkpoint_freq = checkpoint_freq
         self.epoch = 0
         self.best_loss = float('inf')
         self.names = None
+        self.timing_names = None
 
     def log_scores(self, loss_names):
         loss_mean = np.array(self.loss_list).mean(axis=0)
@@ -34,10 +53,15 @@ class Logger:
 
         print(loss_string, file=self.log_file)
         self.loss_list = []
+        if self.timing_list:
+            timing_mean = np.array(self.timing_list).mean(axis=0)
+            timing_string = "; ".join(["%s - %.5fs" % (name, value) for name, value in zip(self.timing_names, timing_mean)])
+            print(str(self.epoch).zfill(self.zfill_num) + ") timings: " + timing_string, file=self.log_file)
+            self.timing_list = []
         self.log_file.flush()
 
     def visualize_rec(self, inp, out):
-        image = self.visualizer.visualize(inp['driving'], inp['source'], out)
+        image = self.visualizer.visualize(inp['driving'].float(), inp['source'].float(), to_float32(out))
         imageio.imsave(os.path.join(self.visualizations_dir, "%s-rec.png" % str(self.epoch).zfill(self.zfill_num)), image)
 
     def save_cpk(self, emergent=False):
@@ -50,8 +74,8 @@ class Logger:
     @staticmethod
     def load_cpk(checkpoint_path, inpainting_network=None, dense_motion_network =None, kp_detector=None, 
                 bg_predictor=None, avd_network=None, optimizer=None, optimizer_bg_predictor=None,
-                optimizer_avd=None):
-        checkpoint = torch.load(checkpoint_path)
+                optimizer_avd=None, scaler=None):
+        checkpoint = torch.load(checkpoint_path, map_location='cpu')
         if inpainting_network is not None:
             inpainting_network.load_state_dict(checkpoint['inpainting_network'])
         if kp_detector is not None:
@@ -70,6 +94,8 @@ class Logger:
         if optimizer_avd is not None:
             if 'optimizer_avd' in checkpoint:
                 optimizer_avd.load_state_dict(checkpoint['optimizer_avd'])
+        if scaler is not None and 'scaler' in checkpoint:
+            scaler.load_state_dict(checkpoint['scaler'])
         epoch = -1
         if 'epoch' in checkpoint:
             epoch = checkpoint['epoch']
@@ -79,16 +105,25 @@ class Logger:
         return self
 
     def __exit__(self, exc_type, exc_value, tb):
+        if not self.write:
+            return
         if 'models' in self.__dict__:
             self.save_cpk()
         self.log_file.close()
 
-    def log_iter(self, losses):
+    def log_iter(self, losses, timings=None):
+        if not self.write:
+            return
         losses = collections.OrderedDict(losses.items())
         self.names = list(losses.keys())
         self.loss_list.append(list(losses.values()))
+        if timings is not None:
+            self.timing_names = list(timings.keys())
+            self.timing_list.append(list(timings.values()))
 
     def log_epoch(self, epoch, models, inp, out):
+        if not self.write:
+            return
         self.epoch = epoch
         self.models = models
         if (self.epoch + 1) % self.checkpoint_freq == 0:
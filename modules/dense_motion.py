@@ -2,7 +2,7 @@ from torch import nn
 import torch.nn.functional as F
 import torch
 from modules.util import Hourglass, AntiAliasInterpolation2d, make_coordinate_grid, kp2gaussian
-from modules.util import to_homogeneous, from_homogeneous, UpBlock2d, TPS
+from modules.util import to_homogeneous, from_homogeneous, UpBlock2d, TPS, full_precision
 import math
 
 class DenseMotionNetwork(nn.Module):
@@ -12,7 +12,7 @@ class DenseMotionNetwork(nn.Module):
     """
 
     def __init__(self, block_expansion, num_blocks, max_features, num_tps, num_channels, 
-                 scale_factor=0.25, bg = False, multi_mask = True, kp_variance=0.01):
+                 scale_factor=0.25, bg = False, multi_mask = True, kp_variance=0.01, tps_stride=1):
         super(DenseMotionNetwork, self).__init__()
 
         if scale_factor != 1:
@@ -51,6 +51,8 @@ class DenseMotionNetwork(nn.Module):
         self.num_tps = num_tps
         self.bg = bg
         self.kp_variance = kp_variance
+        # > 1 evaluates the TPS warps on a coarser grid and upsamples them, see TPS.transform_frame
+        self.tps_stride = tps_stride
 
         
     def create_heatmap_representations(self, source_image, kp_driving, kp_source):
@@ -65,15 +67,23 @@ class DenseMotionNetwork(nn.Module):
 
         return heatmap
 
-    def create_transformations(self, source_image, kp_driving, kp_source, bg_param):
-        # K TPS transformaions
+    def create_transformations(self, source_image, kp_driving, kp_source, bg_param, active_tps=None):
+        # the TPS solves and the warps stay in float32 under mixed precision
+        with full_precision(source_image.device):
+            return self.create_float_transformations(source_image, kp_driving, kp_source, bg_param, active_tps)
+
+    def create_float_transformations(self, source_image, kp_driving, kp_source, bg_param, active_tps=None):
+        # K TPS transformaions, only the active_tps ones if given
         bs, _, h, w = source_image.shape
-        kp_1 = kp_driving['fg_kp']
-        kp_2 = kp_source['fg_kp']
+        kp_1 = kp_driving['fg_kp'].float()
+        kp_2 = kp_source['fg_kp'].float()
         kp_1 = kp_1.view(bs, -1, 5, 2)
         kp_2 = kp_2.view(bs, -1, 5, 2)
+        if active_tps is not None:
+            kp_1 = kp_1[:, active_tps]
+            kp_2 = kp_2[:, active_tps]
         trans = TPS(mode = 'kp', bs = bs, kp_1 = kp_1, kp_2 = kp_2)
-        driving_to_source = trans.transform_frame(source_image)
+        driving_to_source = trans.transform_frame(source_image, stride=self.tps_stride)
 
         identity_grid = make_coordinate_grid((h, w), type=kp_1.type()).to(kp_1.device)
         identity_grid = identity_grid.view(1, 1, h, w, 2)
@@ -82,7 +92,7 @@ class DenseMotionNetwork(nn.Module):
         # affine background transformation
         if not (bg_param is None):            
             identity_grid = to_homogeneous(identity_grid)
-            identity_grid = torch.matmul(bg_param.view(bs, 1, 1, 1, 3, 3), identity_grid.unsqueeze(-1)).squeeze(-1)
+            identity_grid = torch.matmul(bg_param.float().view(bs, 1, 1, 1, 3, 3), identity_grid.unsqueeze(-1)).squeeze(-1)
             identity_grid = from_homogeneous(identity_grid)
 
         transformations = torch.cat([identity_grid, driving_to_source], dim=1)
@@ -91,11 +101,12 @@ class DenseMotionNetwork(nn.Module):
     def create_deformed_source_image(self, source_image, transformations):
 
         bs, _, h, w = source_image.shape
-        source_repeat = source_image.unsqueeze(1).unsqueeze(1).repeat(1, self.num_tps + 1, 1, 1, 1, 1)
-        source_repeat = source_repeat.view(bs * (self.num_tps + 1), -1, h, w)
-        transformations = transformations.view((bs * (self.num_tps + 1), h, w, -1))
+        num_transformations = transformations.shape[1]
+        source_repeat = source_image.unsqueeze(1).unsqueeze(1).repeat(1, num_transformations, 1, 1, 1, 1)
+        source_repeat = source_repeat.view(bs * num_transformations, -1, h, w)
+        transformations = transformations.view((bs * num_transformations, h, w, -1))
         deformed = F.grid_sample(source_repeat, transformations, align_corners=True)
-        deformed = deformed.view((bs, self.num_tps+1, -1, h, w))
+        deformed = deformed.view((bs, num_transformations, -1, h, w))
         return deformed
 
     def dropout_softmax(self, X, P):
@@ -115,7 +126,13 @@ class DenseMotionNetwork(nn.Module):
         partition = X_exp.sum(dim=1, keepdim=True) + 1e-6
         return X_exp / partition  
 
-    def forward(self, source_image, kp_driving, kp_source, bg_param = None, dropout_flag=False, dropout_p = 0):
+    def forward(self, source_image, kp_driving, kp_source, bg_param = None, dropout_flag=False, dropout_p = 0,
+                active_tps=None):
+        '''
+        active_tps (inference only) lists the TPS transformations to evaluate, the others are pruned: they are
+        neither warped nor sampled, the hourglass sees the unwarped source in their place and the
+        contribution maps are renormalized over the active ones.
+        '''
         if self.scale_factor != 1:
             source_image = self.down(source_image)
 
@@ -123,8 +140,15 @@ class DenseMotionNetwork(nn.Module):
 
         out_dict = dict()
         heatmap_representation = self.create_heatmap_representations(source_image, kp_driving, kp_source)
-        transformations = self.create_transformations(source_image, kp_driving, kp_source, bg_param)
+        transformations = self.create_transformations(source_image, kp_driving, kp_source, bg_param, active_tps)
         deformed_source = self.create_deformed_source_image(source_image, transformations)
+        if active_tps is not None:
+            # index 0 is the background transformation, always evaluated
+            active = torch.cat([torch.zeros(1, dtype=torch.long), torch.as_tensor(active_tps, dtype=torch.long) + 1])
+            active = active.to(source_image.device)
+            deformed_active = deformed_source
+            deformed_source = deformed_active[:, :1].repeat(1, self.num_tps + 1, 1, 1, 1)
+            deformed_source[:, active] = deformed_active
         out_dict['deformed_source'] = deformed_source
         # out_dict['transformations'] = transformations
         deformed_source = deformed_source.view(bs,-1,h,w)
@@ -133,15 +157,23 @@ class DenseMotionNetwork(nn.Module):
 
         prediction = self.hourglass(input, mode = 1)
 
-        contribution_maps = self.maps(prediction[-1]) 
+        # the softmax and the dropout stay in float32 under mixed precision
+        contribution_maps = self.maps(prediction[-1]).float()
         if(dropout_flag):
             contribution_maps = self.dropout_softmax(contribution_maps, dropout_p)
         else:
             contribution_maps = F.softmax(contribution_maps, dim=1)
+        if active_tps is not None:
+            pruned = torch.ones(self.num_tps + 1, dtype=torch.bool, device=contribution_maps.device)
+            pruned[active] = False
+            contribution_maps = contribution_maps.masked_fill(pruned.view(1, -1, 1, 1), 0)
+            contribution_maps = contribution_maps / contribution_maps.sum(dim=1, keepdim=True)
         out_dict['contribution_maps'] = contribution_maps
 
         # Combine the K+1 transformations
         # Eq(6) in the paper
+        if active_tps is not None:
+            contribution_maps = contribution_maps[:, active]
         contribution_maps = contribution_maps.unsqueeze(2)
         transformations = transformations.permute(0, 1, 4, 2, 3)
         deformation = (transformations * contribution_maps).sum(dim=1)
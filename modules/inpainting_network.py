@@ -36,9 +36,9 @@ class InpaintingNetwork(nn.Module):
         self.final = nn.Conv2d(block_expansion, num_channels, kernel_size=(7, 7), padding=(3, 3))
         self.num_channels = num_channels
 
-    def deform_input(self, inp, deformation):
+    def deform_input(self, inp, deformation, size=None):
         _, h_old, w_old, _ = deformation.shape
-        _, _, h, w = inp.shape
+        h, w = inp.shape[2:] if size is None else size
         if h_old != h or w_old != w:
             deformation = deformation.permute(0, 3, 1, 2)
             deformation = F.interpolate(deformation, size=(h, w), mode='bilinear', align_corners=True)
@@ -52,12 +52,91 @@ class InpaintingNetwork(nn.Module):
         out = inp * occlusion_map
         return out
 
-    def forward(self, source_image, dense_motion):
-        out = self.first(source_image) 
+    def encode_source(self, source_image):
+        '''
+        Encoder feature maps of the source image, they only depend on the source and can be cached across frames.
+        '''
+        out = self.first(source_image)
         encoder_map = [out]
         for i in range(len(self.down_blocks)):
             out = self.down_blocks[i](out)
             encoder_map.append(out)
+        return encoder_map
+
+    def encoder_halo(self):
+        '''
+        Source pixels around a crop that reach its encoder maps, rounded up to whole pixels of the deepest level.
+        '''
+        # pixels of the current level next to a crop border that differ from the maps of the whole source
+        radius = (self.first.conv.kernel_size[0] - 1) // 2
+        for block in self.down_blocks:
+            radius = -(-(radius + (block.conv.kernel_size[0] - 1) // 2) // 2)
+        return radius * 2 ** self.num_down_blocks
+
+    def encode_crop(self, crop, norm_stats, until=None):
+        '''
+        encode_source of a crop of a larger source, the instance norms use norm_stats, the per-channel (mean, var)
+        of every encoder block over the whole source. With until=k the output of the convolution of block k,
+        before its norm, is returned instead. See encoder_norm_stats.
+        '''
+        out = crop
+        encoder_map = []
+        for k, block in enumerate([self.first] + list(self.down_blocks)):
+            out = block.conv(out)
+            if k == until:
+                return out
+            mean, var = norm_stats[k]
+            out = F.relu(F.batch_norm(out, mean, var, block.norm.weight, block.norm.bias, eps=block.norm.eps))
+            if k > 0:
+                out = block.pool(out)
+            encoder_map.append(out)
+        return encoder_map
+
+    def encoder_norm_stats(self, source_image, tile_size):
+        '''
+        Per-channel (mean, var) of the instance norm of every encoder block over a single source image, gathered
+        from tile_size crops so that no full resolution map is built. The source size must be divisible by
+        2 ** num_down_blocks.
+        '''
+        align = 2 ** self.num_down_blocks
+        halo = self.encoder_halo()
+        h, w = source_image.shape[2:]
+        tile = max(align, tile_size // align * align)
+        norm_stats = []
+        for k in range(self.num_down_blocks + 1):
+            # the convolution of down block k runs on level k - 1
+            level = max(k - 1, 0)
+            total, total_sq, count = 0, 0, 0
+            for y in range(0, h, tile):
+                for x in range(0, w, tile):
+                    y0, x0 = max(y - halo, 0), max(x - halo, 0)
+                    y1, x1 = min(y + tile, h), min(x + tile, w)
+                    crop = source_image[:, :, y0:min(y1 + halo, h), x0:min(x1 + halo, w)]
+                    out = self.encode_crop(crop, norm_stats, until=k)
+                    out = out[:, :, ((y - y0) >> level):((y1 - y0) >> level),
+                              ((x - x0) >> level):((x1 - x0) >> level)].double()
+                    total = total + out.sum((0, 2, 3))
+                    total_sq = total_sq + (out ** 2).sum((0, 2, 3))
+                    count += out.numel() // out.shape[1]
+            mean = total / count
+            norm_stats.append((mean.float().detach(), (total_sq / count - mean ** 2).float().detach()))
+        return norm_stats
+
+    def forward(self, source_image, dense_motion, encoder_map=None):
+        '''
+        The deformation can also be a list with one deformation per encoder level, finest first, each of the
+        size of its warped map, e.g. for a tile of a larger output: source_image and encoder_map may then
+        be crops of the source that the deformations point into.
+        '''
+        if encoder_map is None:
+            encoder_map = self.encode_source(source_image)
+        deformation = dense_motion['deformation']
+        deformations = deformation if isinstance(deformation, list) else [deformation] * (self.num_down_blocks + 1)
+        # spatial size of the warped encoder map of every level, that of the input without per level deformations
+        level_shapes = [None] * (self.num_down_blocks + 1)
+        if isinstance(deformation, list):
+            level_shapes = [tuple(level.shape[1:3]) for level in deformations]
+        out = encoder_map[-1]
 
         output_dict = {}
         output_dict['contribution_maps'] = dense_motion['contribution_maps']
@@ -66,9 +145,8 @@ class InpaintingNetwork(nn.Module):
         occlusion_map = dense_motion['occlusion_map']
         output_dict['occlusion_map'] = occlusion_map
 
-        deformation = dense_motion['deformation']
-        out_ij = self.deform_input(out.detach(), deformation)
-        out = self.deform_input(out, deformation)
+        out_ij = self.deform_input(out.detach(), deformations[-1], level_shapes[-1])
+        out = self.deform_input(out, deformations[-1], level_shapes[-1])
 
         out_ij = self.occlude_input(out_ij, occlusion_map[0].detach())
         out = self.occlude_input(out, occlusion_map[0])
@@ -83,8 +161,8 @@ class InpaintingNetwork(nn.Module):
             out = self.up_blocks[i](out)
             
             encode_i = encoder_map[-(i+2)]
-            encode_ij = self.deform_input(encode_i.detach(), deformation)
-            encode_i = self.deform_input(encode_i, deformation)
+            encode_ij = self.deform_input(encode_i.detach(), deformations[-(i+2)], level_shapes[-(i+2)])
+            encode_i = self.deform_input(encode_i, deformations[-(i+2)], level_shapes[-(i+2)])
             
             occlusion_ind = 0
             if self.multi_mask:
@@ -98,7 +176,7 @@ class InpaintingNetwork(nn.Module):
 
             out = torch.cat([out, encode_i], 1)
 
-        deformed_source = self.deform_input(source_image, deformation)
+        deformed_source = self.deform_input(source_image, deformations[0], level_shapes[0])
         output_dict["deformed"] = deformed_source
         output_dict["warped_encoder_maps"] = warped_encoder_maps
 
@@ -1,18 +1,19 @@
 from torch import nn
 import torch
 import torch.nn.functional as F
-from modules.util import AntiAliasInterpolation2d, TPS
+import math
+from modules.util import AntiAliasInterpolation2d, TPS, full_precision, CheckpointBlock
 from torchvision import models
 import numpy as np
 
 
-class Vgg19(torch.nn.Module):
+class Vgg19(CheckpointBlock):
     """
     Vgg19 network for perceptual loss. See Sec 3.3.
     """
-    def __init__(self, requires_grad=False):
+    def __init__(self, requires_grad=False, pretrained=True):
         super(Vgg19, self).__init__()
-        vgg_pretrained_features = models.vgg19(pretrained=True).features
+        vgg_pretrained_features = models.vgg19(pretrained=pretrained).features
         self.slice1 = torch.nn.Sequential()
         self.slice2 = torch.nn.Sequential()
         self.slice3 = torch.nn.Sequential()
@@ -52,18 +53,31 @@ class Vgg19(torch.nn.Module):
 class ImagePyramide(torch.nn.Module):
     """
     Create image pyramide for computing pyramide perceptual loss. See Sec 3.3
+    With cascade every scale is downsampled from the previous one with the blur it still lacks,
+    small kernels on small images instead of e.g. 29x29 at full resolution for 0.125. The smaller scales
+    come out slightly different, and so do the perceptual loss values.
     """
-    def __init__(self, scales, num_channels):
+    def __init__(self, scales, num_channels, cascade=False):
         super(ImagePyramide, self).__init__()
+        self.cascade = cascade
         downs = {}
-        for scale in scales:
-            downs[str(scale).replace('.', '-')] = AntiAliasInterpolation2d(num_channels, scale)
+        previous = 1
+        for scale in sorted(scales, reverse=True):
+            if cascade:
+                # gaussian blurs add up in variance, (1 / scale - 1) / 2 pixels of the full resolution in total
+                sigma = math.sqrt(((1 / scale - 1) / 2) ** 2 - ((1 / previous - 1) / 2) ** 2) * previous
+                downs[str(scale).replace('.', '-')] = AntiAliasInterpolation2d(num_channels, scale / previous, sigma)
+                previous = scale
+            else:
+                downs[str(scale).replace('.', '-')] = AntiAliasInterpolation2d(num_channels, scale)
         self.downs = nn.ModuleDict(downs)
 
     def forward(self, x):
         out_dict = {}
+        out = x
         for scale, down_module in self.downs.items():
-            out_dict['prediction_' + str(scale).replace('-', '.')] = down_module(x)
+            out = down_module(out if self.cascade else x)
+            out_dict['prediction_' + str(scale).replace('-', '.')] = out
         return out_dict
 
 
@@ -89,8 +103,10 @@ class GeneratorFullModel(torch.nn.Module):
 
         self.train_params = train_params
         self.scales = train_params['scales']
+        self.use_amp = train_params.get('use_amp', False)
 
-        self.pyramid = ImagePyramide(self.scales, inpainting_network.num_channels)
+        self.pyramid = ImagePyramide(self.scales, inpainting_network.num_channels,
+                                     cascade=train_params.get('pyramid_cascade', False))
         if torch.cuda.is_available():
             self.pyramid = self.pyramid.cuda()
 
@@ -107,6 +123,30 @@ class GeneratorFullModel(torch.nn.Module):
 
 
     def forward(self, x, epoch):
+        # autocast is thread local, so it is entered here, in every DataParallel replica
+        with torch.autocast(device_type=x['source'].device.type, enabled=self.use_amp):
+            return self.compute_losses(x, epoch)
+
+    def perceptual_loss(self, real, generated):
+        """
+        Pyramide perceptual loss of generated against real, the real features are computed without a graph.
+        """
+        with torch.no_grad():
+            pyramide_real = self.pyramid(real)
+        pyramide_generated = self.pyramid(generated)
+
+        value_total = 0
+        for scale in self.scales:
+            x_vgg = self.vgg(pyramide_generated['prediction_' + str(scale)])
+            with torch.no_grad():
+                y_vgg = self.vgg(pyramide_real['prediction_' + str(scale)])
+
+            for i, weight in enumerate(self.loss_weights['perceptual']):
+                value = torch.abs(x_vgg[i] - y_vgg[i]).mean(dtype=torch.float32)
+                value_total += weight * value
+        return value_total
+
+    def compute_losses(self, x, epoch):
         kp_source = self.kp_extractor(x['source'])
         kp_driving = self.kp_extractor(x['driving'])
         bg_param = None
@@ -130,20 +170,9 @@ class GeneratorFullModel(torch.nn.Module):
 
         loss_values = {}
 
-        pyramide_real = self.pyramid(x['driving'])
-        pyramide_generated = self.pyramid(generated['prediction'])
-
         # reconstruction loss
         if sum(self.loss_weights['perceptual']) != 0:
-            value_total = 0
-            for scale in self.scales:
-                x_vgg = self.vgg(pyramide_generated['prediction_' + str(scale)])
-                y_vgg = self.vgg(pyramide_real['prediction_' + str(scale)])
-
-                for i, weight in enumerate(self.loss_weights['perceptual']):
-                    value = torch.abs(x_vgg[i] - y_vgg[i].detach()).mean()
-                    value_total += self.loss_weights['perceptual'][i] * value
-            loss_values['perceptual'] = value_total
+            loss_values['perceptual'] = self.perceptual_loss(x['driving'], generated['prediction'])
 
         # equivariance loss
         if self.loss_weights['equivariance_value'] != 0:
@@ -157,7 +186,7 @@ class GeneratorFullModel(torch.nn.Module):
         
             warped = transform_random.warp_coordinates(transformed_kp['fg_kp'])
             kp_d = kp_driving['fg_kp']
-            value = torch.abs(kp_d - warped).mean()
+            value = torch.abs(kp_d.float() - warped).mean()
             loss_values['equivariance_value'] = self.loss_weights['equivariance_value'] * value
 
         # warp loss
@@ -167,16 +196,17 @@ class GeneratorFullModel(torch.nn.Module):
             decode_map = generated['warped_encoder_maps']
             value = 0
             for i in range(len(encode_map)):
-                value += torch.abs(encode_map[i]-decode_map[-i-1]).mean()
+                value += torch.abs(encode_map[i]-decode_map[-i-1]).mean(dtype=torch.float32)
 
             loss_values['warp_loss'] = self.loss_weights['warp_loss'] * value
         
         # bg loss
         if self.bg_predictor and epoch >= self.bg_start and self.loss_weights['bg'] != 0:
             bg_param_reverse = self.bg_predictor(x['driving'], x['source'])
-            value = torch.matmul(bg_param, bg_param_reverse)
-            eye = torch.eye(3).view(1, 1, 3, 3).type(value.type())
-            value = torch.abs(eye - value).mean()
+            with full_precision(bg_param.device):
+                value = torch.matmul(bg_param.float(), bg_param_reverse.float())
+                eye = torch.eye(3).view(1, 1, 3, 3).type(value.type())
+                value = torch.abs(eye - value).mean()
             loss_values['bg'] = self.loss_weights['bg'] * value
 
         return loss_values, generated
@@ -1,6 +1,57 @@
 from torch import nn
 import torch.nn.functional as F
 import torch
+import inspect
+from torch.utils.checkpoint import checkpoint
+
+
+def full_precision(device):
+    '''
+    Context in which operations run in float32 even under automatic mixed precision.
+    '''
+    return torch.autocast(device_type=device.type, enabled=False)
+
+
+# non-reentrant checkpointing (torch >= 1.11) also gives the parameter gradients of blocks whose inputs need none
+CHECKPOINT_KWARGS = {'use_reentrant': False} if 'use_reentrant' in inspect.signature(checkpoint).parameters else {}
+
+
+def checkpoint_call(function, *inputs):
+    '''
+    function(*inputs) with its activations recomputed in the backward pass instead of stored.
+    '''
+    if not CHECKPOINT_KWARGS and not any(inp.requires_grad for inp in inputs):
+        # reentrant checkpointing would drop the parameter gradients
+        return function(*inputs)
+    return checkpoint(function, *inputs, **CHECKPOINT_KWARGS)
+
+
+class CheckpointBlock(nn.Module):
+    '''
+    Block whose activations can be recomputed in the backward pass instead of stored, to fit larger
+    batches or resolutions in memory at the cost of a second forward pass. See set_activation_checkpointing.
+    '''
+    checkpoint = False
+
+    def __call__(self, *inputs):
+        if self.checkpoint and self.training and torch.is_grad_enabled():
+            return checkpoint_call(super(CheckpointBlock, self).__call__, *inputs)
+        return super(CheckpointBlock, self).__call__(*inputs)
+
+
+def set_activation_checkpointing(module, block_names, enabled=True):
+    '''
+    Turn activation checkpointing on (or off) for every block of module, module included, whose class name
+    is in block_names, e.g. ['DownBlock2d', 'UpBlock2d'].
+    '''
+    found = set()
+    for block in module.modules():
+        if type(block).__name__ in block_names and isinstance(block, CheckpointBlock):
+            block.checkpoint = enabled
+            found.add(type(block).__name__)
+    missing = set(block_names) - found
+    if missing:
+        raise ValueError("%s has no checkpointable %s" % (type(module).__name__, ', '.join(sorted(missing))))
 
 
 class TPS:
@@ -49,16 +100,33 @@ class TPS:
         else:
             raise Exception("Error TPS mode")
 
-    def transform_frame(self, frame):
-        grid = make_coordinate_grid(frame.shape[2:], type=frame.type()).unsqueeze(0).to(frame.device)
-        grid = grid.view(1, frame.shape[2] * frame.shape[3], 2)
-        shape = [self.bs, frame.shape[2], frame.shape[3], 2]
+    def transform_frame(self, frame, stride=1):
+        '''
+        Warped coordinates for every pixel of frame. With stride > 1 the TPS is evaluated on a grid
+        about stride times coarser, which keeps the corners, and bilinearly upsampled to the frame size.
+        '''
+        h, w = frame.shape[2:]
+        if stride > 1:
+            h, w = (h + stride - 2) // stride + 1, (w + stride - 2) // stride + 1
+        # float32 coordinates even for a reduced precision frame
+        grid = make_coordinate_grid((h, w), type=torch.float32).unsqueeze(0).to(frame.device)
+        grid = grid.view(1, h * w, 2)
+        shape = [self.bs, h, w, 2]
         if self.mode == 'kp':
             shape.insert(1, self.gs)
         grid = self.warp_coordinates(grid).view(*shape)
+        if (h, w) != tuple(frame.shape[2:]):
+            grid = grid.view(-1, h, w, 2).permute(0, 3, 1, 2)
+            grid = F.interpolate(grid, size=frame.shape[2:], mode='bilinear', align_corners=True)
+            shape[-3:-1] = frame.shape[2:]
+            grid = grid.permute(0, 2, 3, 1).reshape(*shape)
         return grid
 
     def warp_coordinates(self, coordinates):
+        with full_precision(coordinates.device):
+            return self.warp_float_coordinates(coordinates.float())
+
+    def warp_float_coordinates(self, coordinates):
         theta = self.theta.type(coordinates.type()).to(coordinates.device)
         control_points = self.control_points.type(coordinates.type()).to(coordinates.device)
         control_params = self.control_params.type(coordinates.type()).to(coordinates.device)
@@ -134,7 +202,7 @@ def make_coordinate_grid(spatial_size, type):
     return meshed
 
 
-class ResBlock2d(nn.Module):
+class ResBlock2d(CheckpointBlock):
     """
     Res block, preserve spatial resolution.
     """
@@ -159,7 +227,7 @@ class ResBlock2d(nn.Module):
         return out
 
 
-class UpBlock2d(nn.Module):
+class UpBlock2d(CheckpointBlock):
     """
     Upsampling block for use in decoder.
     """
@@ -179,7 +247,7 @@ class UpBlock2d(nn.Module):
         return out
 
 
-class DownBlock2d(nn.Module):
+class DownBlock2d(CheckpointBlock):
     """
     Downsampling block for use in encoder.
     """
@@ -199,7 +267,7 @@ class DownBlock2d(nn.Module):
         return out
 
 
-class SameBlock2d(nn.Module):
+class SameBlock2d(CheckpointBlock):
     """
     Simple block, preserve spatial resolution.
     """
@@ -295,9 +363,11 @@ class AntiAliasInterpolation2d(nn.Module):
     """
     Band-limited downsampling, for better preservation of the input signal.
     """
-    def __init__(self, channels, scale):
+    def __init__(self, channels, scale, sigma=None):
         super(AntiAliasInterpolation2d, self).__init__()
-        sigma = (1 / scale - 1) / 2
+        # blur in input pixels
+        if sigma is None:
+            sigma = (1 / scale - 1) / 2
         kernel_size = 2 * round(sigma * 4) + 1
         self.ka = kernel_size // 2
         self.kb = self.ka - 1 if kernel_size % 2 == 0 else self.ka
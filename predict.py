@@ -7,8 +7,6 @@ import imageio
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
-from skimage.transform import resize
-from skimage import img_as_ubyte
 import torch
 import torchvision.transforms as transforms
 import dlib
@@ -16,6 +14,7 @@ from cog import BasePredictor, Path, Input
 
 from demo import load_checkpoints
 from demo import make_animation
+from demo import load_video, resize_frame
 from ffhq_dataset.face_alignment import image_align
 from ffhq_dataset.landmarks_detector import LandmarksDetector
 
@@ -39,6 +38,10 @@ class Predictor(BasePredictor):
             self.avd_network,
         ) = ({}, {}, {}, {})
         for d in datasets:
+            # directories written by convert_checkpoint.py load without random init and optimizer states
+            checkpoint_path = f"checkpoints/{d}"
+            if not os.path.isdir(checkpoint_path):
+                checkpoint_path = f"checkpoints/{d}.pth.tar"
             (
                 self.inpainting[d],
                 self.kp_detector[d],
@@ -48,7 +51,7 @@ class Predictor(BasePredictor):
                 config_path=f"config/{d}-384.yaml"
                 if d == "ted"
                 else f"config/{d}-256.yaml",
-                checkpoint_path=f"checkpoints/{d}.pth.tar",
+                checkpoint_path=checkpoint_path,
                 device=self.device,
             )
 
@@ -78,21 +81,8 @@ class Predictor(BasePredictor):
             source_image = imageio.imread('aligned.png')
         else:
             source_image = imageio.imread(str(source_image))
-        reader = imageio.get_reader(str(driving_video))
-        fps = reader.get_meta_data()["fps"]
-        source_image = resize(source_image, (pixel, pixel))[..., :3]
-
-        driving_video = []
-        try:
-            for im in reader:
-                driving_video.append(im)
-        except RuntimeError:
-            pass
-        reader.close()
-
-        driving_video = [
-            resize(frame, (pixel, pixel))[..., :3] for frame in driving_video
-        ]
+        source_image = resize_frame(source_image, (pixel, pixel))
+        driving_video, fps = load_video(str(driving_video), (pixel, pixel))
 
         inpainting, kp_detector, dense_motion_network, avd_network = (
             self.inpainting[dataset_name],
@@ -114,9 +104,7 @@ class Predictor(BasePredictor):
 
         # save resulting video
         out_path = Path(tempfile.mkdtemp()) / "output.mp4"
-        imageio.mimsave(
-            str(out_path), [img_as_ubyte(frame) for frame in predictions], fps=fps
-        )
+        imageio.mimsave(str(out_path), predictions, fps=fps)
         return out_path
 
 
@@ -14,6 +14,7 @@ from modules.bg_motion_predictor import BGMotionPredictor
 from modules.dense_motion import DenseMotionNetwork
 from modules.avd_network import AVDNetwork
 import torch
+import torch.distributed as dist
 from train import train
 from train_avd import train_avd
 from reconstruction import reconstruction
@@ -32,16 +33,35 @@ if __name__ == "__main__":
     parser.add_argument("--checkpoint", default=None, help="path to checkpoint to restore")
     parser.add_argument("--device_ids", default="0,1", type=lambda x: list(map(int, x.split(','))),
                         help="Names of the devices comma separated.")
+    parser.add_argument("--dist_backend", default=None, choices=["nccl", "gloo"],
+                        help="backend of a torchrun launch, nccl on gpus and gloo on cpus by default")
 
     opt = parser.parse_args()
     with open(opt.config) as f:
         config = yaml.load(f)
 
+    # torchrun sets WORLD_SIZE, every process trains on device LOCAL_RANK with DistributedDataParallel
+    distributed = int(os.environ.get('WORLD_SIZE', 1)) > 1
+    rank = 0
+    if distributed:
+        if opt.mode != 'train':
+            raise ValueError("Only the train mode can be distributed")
+        dist.init_process_group(backend=opt.dist_backend or ('nccl' if torch.cuda.is_available() else 'gloo'))
+        rank = dist.get_rank()
+        if torch.cuda.is_available():
+            opt.device_ids = [int(os.environ['LOCAL_RANK'])]
+            torch.cuda.set_device(opt.device_ids[0])
+
     if opt.checkpoint is not None:
         log_dir = os.path.join(*os.path.split(opt.checkpoint)[:-1])
     else:
         log_dir = os.path.join(opt.log_dir, os.path.basename(opt.config).split('.')[0])
         log_dir += ' ' + strftime("%d_%m_%y_%H.%M.%S", gmtime())
+        if distributed:
+            # the time of the first process names the directory of all of them
+            log_dir = [log_dir]
+            dist.broadcast_object_list(log_dir, src=0)
+            log_dir = log_dir[0]
 
     inpainting = InpaintingNetwork(**config['model_params']['generator_params'],
                                         **config['model_params']['common_params'])
@@ -73,14 +93,17 @@ if __name__ == "__main__":
 
     dataset = FramesDataset(is_train=(opt.mode.startswith('train')), **config['dataset_params'])
 
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
-    if not os.path.exists(os.path.join(log_dir, os.path.basename(opt.config))):
-        copy(opt.config, log_dir)
+    if rank == 0:
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        if not os.path.exists(os.path.join(log_dir, os.path.basename(opt.config))):
+            copy(opt.config, log_dir)
 
     if opt.mode == 'train':
         print("Training...")
         train(config, inpainting, kp_detector, bg_predictor, dense_motion_network, opt.checkpoint, log_dir, dataset)
+        if distributed:
+            dist.destroy_process_group()
     elif opt.mode == 'train_avd':
         print("Training Animation via Disentaglement...")
         train_avd(config, inpainting, kp_detector, bg_predictor, dense_motion_network, avd_network, opt.checkpoint, log_dir, dataset)
@@ -1,11 +1,13 @@
 from tqdm import trange
 import torch
-from torch.utils.data import DataLoader
 from logger import Logger
 from modules.model import GeneratorFullModel
+from modules.util import set_activation_checkpointing
 from torch.optim.lr_scheduler import MultiStepLR
 from torch.nn.utils import clip_grad_norm_
-from frames_dataset import DatasetRepeater
+from torch.nn.parallel import DistributedDataParallel
+import torch.distributed as dist
+from frames_dataset import DatasetRepeater, BatchPrefetcher, training_dataloader
 import math
 
 def train(config, inpainting_network, kp_detector, bg_predictor, dense_motion_network, checkpoint, log_dir, dataset):
@@ -21,11 +23,15 @@ def train(config, inpainting_network, kp_detector, bg_predictor, dense_motion_ne
             [{'params':bg_predictor.parameters(),'initial_lr': train_params['lr_generator']}], 
             lr=train_params['lr_generator'], betas=(0.5, 0.999), weight_decay = 1e-4)
 
+    # loss scaling for mixed precision, a no-op without use_amp
+    use_amp = train_params.get('use_amp', False)
+    scaler = torch.cuda.amp.GradScaler(enabled=use_amp)
+
     if checkpoint is not None:
         start_epoch = Logger.load_cpk(
             checkpoint, inpainting_network = inpainting_network, dense_motion_network = dense_motion_network,       
             kp_detector = kp_detector, bg_predictor = bg_predictor,
-            optimizer = optimizer, optimizer_bg_predictor = optimizer_bg_predictor)
+            optimizer = optimizer, optimizer_bg_predictor = optimizer_bg_predictor, scaler = scaler)
         print('load success:', start_epoch)
         start_epoch += 1
     else:
@@ -37,44 +43,75 @@ def train(config, inpainting_network, kp_detector, bg_predictor, dense_motion_ne
         scheduler_bg_predictor = MultiStepLR(optimizer_bg_predictor, train_params['epoch_milestones'],
                                               gamma=0.1, last_epoch=start_epoch - 1)
 
+    num_videos, pairs_per_video = len(dataset), getattr(dataset, 'pairs_per_video', 1)
+    # augmentation of whole batches on the device, see FramesDataset's augmentation_backend
+    batch_transform = getattr(dataset, 'batch_transform', None)
     if 'num_repeats' in train_params or train_params['num_repeats'] != 1:
         dataset = DatasetRepeater(dataset, train_params['num_repeats'])
-    dataloader = DataLoader(dataset, batch_size=train_params['batch_size'], shuffle=True, 
-                            num_workers=train_params['dataloader_workers'], drop_last=True)
+    # batches are staged on the gpu ahead of use, as floats even from uint8 samples
+    dataloader = BatchPrefetcher(training_dataloader(dataset, num_videos, pairs_per_video, train_params))
 
     generator_full = GeneratorFullModel(kp_detector, bg_predictor, dense_motion_network, inpainting_network, train_params)
+    # network -> blocks whose activations are recomputed in the backward pass
+    for name, block_names in (train_params.get('activation_checkpointing') or {}).items():
+        network = getattr(generator_full, name, None)
+        if network is None and name in ['vgg', 'bg_predictor']:
+            print('activation_checkpointing: %s is disabled in this config, skipped' % name)
+            continue
+        if not isinstance(network, torch.nn.Module):
+            raise ValueError("activation_checkpointing: unknown network %s, expected dense_motion_network, "
+                             "inpainting_network, vgg, bg_predictor or kp_extractor" % name)
+        set_activation_checkpointing(network, block_names)
 
-    if torch.cuda.is_available():
+    # started by run.py under torchrun, one process per device
+    distributed = dist.is_available() and dist.is_initialized()
+    if distributed:
+        # wrapped in DistributedDataParallel at the start of each epoch, see below
+        device_ids = [torch.cuda.current_device()] if torch.cuda.is_available() else None
+        generator_module = generator_full
+    elif torch.cuda.is_available():
         generator_full = torch.nn.DataParallel(generator_full).cuda()  
         
     bg_start = train_params['bg_start']
     
     with Logger(log_dir=log_dir, visualizer_params=config['visualizer_params'], 
-                checkpoint_freq=train_params['checkpoint_freq']) as logger:
+                checkpoint_freq=train_params['checkpoint_freq'],
+                write=not distributed or dist.get_rank() == 0) as logger:
         for epoch in trange(start_epoch, train_params['num_epochs']):
+            dataloader.set_epoch(epoch)
+            if distributed:
+                # the bg_predictor has no gradients before bg_start, only then DDP has to look for unused parameters
+                find_unused = train_params.get('find_unused_parameters', False) or (bool(bg_predictor) and epoch < bg_start)
+                if generator_full is generator_module or generator_full.find_unused_parameters != find_unused:
+                    generator_full = DistributedDataParallel(generator_module, device_ids=device_ids,
+                                                             find_unused_parameters=find_unused)
             for x in dataloader:
-                if(torch.cuda.is_available()):
-                    x['driving'] = x['driving'].cuda()
-                    x['source'] = x['source'].cuda()
+                if batch_transform is not None:
+                    x['source'], x['driving'] = batch_transform.augment_pairs(x['source'], x['driving'])
 
                 losses_generator, generated = generator_full(x, epoch)
                 loss_values = [val.mean() for val in losses_generator.values()]
                 loss = sum(loss_values)
-                loss.backward()
+                scaler.scale(loss).backward()
 
+                # the gradients are clipped unscaled
+                scaler.unscale_(optimizer)
+                if bg_predictor and epoch>=bg_start:
+                    scaler.unscale_(optimizer_bg_predictor)
                 clip_grad_norm_(kp_detector.parameters(), max_norm=10, norm_type = math.inf)
                 clip_grad_norm_(dense_motion_network.parameters(), max_norm=10, norm_type = math.inf)
                 if bg_predictor and epoch>=bg_start:
                     clip_grad_norm_(bg_predictor.parameters(), max_norm=10, norm_type = math.inf)
                 
-                optimizer.step()
+                scaler.step(optimizer)
                 optimizer.zero_grad()
                 if bg_predictor and epoch>=bg_start:
-                    optimizer_bg_predictor.step()
+                    scaler.step(optimizer_bg_predictor)
                     optimizer_bg_predictor.zero_grad()
+                scaler.update()
                 
                 losses = {key: value.mean().detach().data.cpu().numpy() for key, value in losses_generator.items()}
-                logger.log_iter(losses=losses)
+                logger.log_iter(losses=losses, timings={'data_wait': dataloader.data_wait})
 
             scheduler_optimizer.step()
             if bg_predictor:
@@ -86,6 +123,8 @@ def train(config, inpainting_network, kp_detector, bg_predictor, dense_motion_ne
                 'kp_detector': kp_detector,
                 'optimizer': optimizer,
             }
+            if use_amp:
+                model_save['scaler'] = scaler
             if bg_predictor and epoch>=bg_start:
                 model_save['bg_predictor'] = bg_predictor
                 model_save['optimizer_bg_predictor'] = optimizer_bg_predictor
@@ -1,9 +1,8 @@
 from tqdm import trange
 import torch
-from torch.utils.data import DataLoader
 from logger import Logger
 from torch.optim.lr_scheduler import MultiStepLR
-from frames_dataset import DatasetRepeater
+from frames_dataset import DatasetRepeater, BatchPrefetcher, training_dataloader
 
 
 def random_scale(kp_params, scale):
@@ -29,20 +28,25 @@ def train_avd(config, inpainting_network, kp_detector, bg_predictor, dense_motio
 
     scheduler = MultiStepLR(optimizer, train_params['epoch_milestones'], gamma=0.1)
 
+    num_videos, pairs_per_video = len(dataset), getattr(dataset, 'pairs_per_video', 1)
+    # augmentation of whole batches on the device, see FramesDataset's augmentation_backend
+    batch_transform = getattr(dataset, 'batch_transform', None)
     if 'num_repeats' in train_params or train_params['num_repeats'] != 1:
         dataset = DatasetRepeater(dataset, train_params['num_repeats'])
 
-    dataloader = DataLoader(dataset, batch_size=train_params['batch_size'], shuffle=True,
-                            num_workers=train_params['dataloader_workers'], drop_last=True)
+    # batches are staged on the gpu ahead of use, as floats even from uint8 samples
+    dataloader = BatchPrefetcher(training_dataloader(dataset, num_videos, pairs_per_video, train_params))
 
     with Logger(log_dir=log_dir, visualizer_params=config['visualizer_params'], 
                 checkpoint_freq=train_params['checkpoint_freq']) as logger:
         for epoch in trange(start_epoch, train_params['num_epochs']):
             avd_network.train()
             for x in dataloader:
+                if batch_transform is not None:
+                    x['source'], x['driving'] = batch_transform.augment_pairs(x['source'], x['driving'])
                 with torch.no_grad():
-                    kp_source = kp_detector(x['source'].cuda())
-                    kp_driving_gt = kp_detector(x['driving'].cuda())
+                    kp_source = kp_detector(x['source'])
+                    kp_driving_gt = kp_detector(x['driving'])
                     kp_driving_random = random_scale(kp_driving_gt, scale=train_params['random_scale'])
                 rec = avd_network(kp_source, kp_driving_random)
 
@@ -57,7 +61,7 @@ def train_avd(config, inpainting_network, kp_detector, bg_predictor, dense_motio
                 optimizer.zero_grad()
 
                 losses = {key: value.mean().detach().data.cpu().numpy() for key, value in loss_dict.items()}
-                logger.log_iter(losses=losses)
+                logger.log_iter(losses=losses, timings={'data_wait': dataloader.data_wait})
 
             # Visualization
             avd_network.eval()